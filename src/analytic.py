@@ -0,0 +1,157 @@
+import math
+
+import numpy as np
+
+
+# |----------------|
+# | M/M/c stations |
+# |----------------|
+
+
+def erlang_c(servers, load):
+    """
+    Probability that an arrival has to wait at an M/M/c station with servers
+    servers and offered load arrival_rate * mean_service (Erlang C formula).
+    Computed through the Erlang B recursion, which stays stable for large
+    server counts. Returns 1 when the station is unstable.
+    """
+    if load >= servers:
+        return 1.0
+    if load <= 0:
+        return 0.0
+    blocking = 1.0
+    for k in range(1, servers + 1):
+        blocking = load * blocking / (k + load * blocking)
+    return servers * blocking / (servers - load * (1 - blocking))
+
+
+def mmc(arrival_rate, servers, mean_service):
+    """
+    Steady-state measures of an M/M/c station: utilization of the servers,
+    probability of waiting, mean wait in queue (of all arrivals and of those
+    who wait), mean sojourn, mean queue length and mean number at the
+    station. Means are infinite when the station is unstable.
+    """
+    if servers < 1:
+        raise ValueError("A station needs at least one server")
+    load = arrival_rate * mean_service
+    utilization = load / servers
+    stable = utilization < 1
+    p_wait = erlang_c(servers, load)
+    if stable:
+        wait_if_waiting = mean_service / (servers - load) if load > 0 else 0.0
+        wait = p_wait * wait_if_waiting
+    else:
+        wait_if_waiting = wait = math.inf
+    return {
+        "stable": stable,
+        "arrival_rate": arrival_rate,
+        "utilization": utilization,
+        "mean_busy_servers": load,
+        "p_wait": p_wait,
+        "wait": wait,
+        "wait_if_waiting": wait_if_waiting,
+        "sojourn": wait + mean_service,
+        # Little's law on the queue and on the whole station
+        "queue_length": arrival_rate * wait if stable else math.inf,
+        "in_station": arrival_rate * wait + load if stable else math.inf,
+    }
+
+
+# |-----------------|
+# | Jackson network |
+# |-----------------|
+
+
+def traffic_equations(network, arrival_rate):
+    """
+    Solves the traffic equations of an open network, rates = external +
+    P.T @ rates, and returns the total arrival rate at every stage, feedback
+    included. External arrivals all enter at network.entry.
+    """
+    P = network.routing_matrix()
+    external = np.zeros(len(network.stages))
+    external[network.index[network.entry]] = arrival_rate
+    try:
+        return np.linalg.solve(np.eye(len(external)) - P.T, external)
+    except np.linalg.LinAlgError:
+        raise ValueError("Appliances can never leave the network") from None
+
+
+def _mean_service(stage):
+    # Jackson networks need exponential services given by their mean
+    service = stage.service
+    if callable(service) or service[0] != "exponential" or len(service) != 2:
+        raise ValueError(
+            f"Stage {stage.name!r} needs an ('exponential', mean) service, "
+            f"not {service!r}"
+        )
+    return service[1]
+
+
+def solve_network(network, arrival_rate):
+    """
+    Steady state of an open Jackson network: Poisson arrivals at the entry
+    stage, exponential services and probabilistic routing, feedback
+    included. Every stage then behaves as an independent M/M/c station fed
+    with its total rate from traffic_equations.
+
+    Returns a dict with "stable", the names of the "unstable" stages, the
+    mean number of appliances "in_system", the mean "time_in_system" (by
+    Little's law) and the mmc measures of every stage in "stages", plus its
+    mean number of "visits" per appliance.
+    """
+    rates = traffic_equations(network, arrival_rate)
+    stages = {}
+    for stage, rate in zip(network.stages, rates.tolist()):
+        stages[stage.name] = dict(
+            mmc(rate, stage.servers, _mean_service(stage)),
+            visits=rate / arrival_rate if arrival_rate > 0 else 0.0,
+        )
+    unstable = [name for name, measures in stages.items() if not measures["stable"]]
+    in_system = sum(measures["in_station"] for measures in stages.values())
+    return {
+        "stable": not unstable,
+        "unstable": unstable,
+        "in_system": in_system,
+        "time_in_system": in_system / arrival_rate if arrival_rate > 0 else 0.0,
+        "stages": stages,
+    }
+
+
+def analytic_summary(**parameters):
+    """
+    Solves the company for parameters named as in
+    replication.DEFAULT_PARAMETERS and returns a flat dict with the same
+    names as the summaries of the simulators: time_in_system and, per stage,
+    wait_, utilization_ and queue_length_, plus "stable".
+
+    These are steady-state values. Simulated runs start empty and stop
+    arrivals at simulation_time, so short runs sit below them. The waits
+    are means over every visit, zero waits included, like the waits of the
+    replication, lockstep and Statistics.report() summaries.
+    """
+    from network import company_network
+    from replication import DEFAULT_PARAMETERS
+
+    unknown = set(parameters) - set(DEFAULT_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown parameters {sorted(unknown)}")
+    params = dict(DEFAULT_PARAMETERS, **parameters)
+    network = company_network()
+    network = network.with_servers(
+        **{name: params[f"{name}_servers"] for name in network.names}
+    ).with_services(
+        **{name: ("exponential", params[f"{name}_mean"]) for name in network.names}
+    )
+
+    solution = solve_network(network, params["arrival_rate"])
+    summary = {
+        "stable": solution["stable"],
+        "time_in_system": solution["time_in_system"],
+    }
+    for name, measures in solution["stages"].items():
+        summary[f"wait_{name}"] = measures["wait"]
+        summary[f"utilization_{name}"] = measures["utilization"]
+        summary[f"queue_length_{name}"] = measures["queue_length"]
+    return summary
@@ -0,0 +1,299 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import io
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from event_list import EVENT_LISTS, make_event_list
+from instrumentation import Profiler
+from replication import build_simulation
+
+
+# |------------------|
+# | Queue discipline |
+# |------------------|
+
+
+def overload_scaling(
+    arrival_rate=2, horizons=(8000, 16000, 32000, 64000, 128000), seed=0
+):
+    """
+    Runs the company above its capacity for growing horizons, so the queues
+    grow without bound, and times every run. Transitions are recorded in an
+    EventLog so that the growth of the statistics dicts does not blur the
+    cost of the queues.
+
+    Returns the rows (horizon, appliances, seconds) and the exponent b of the
+    fit seconds ~ appliances ** b, which stays close to 1 when the cost per
+    event does not depend on the queue lengths.
+    """
+    rows = []
+    for horizon in horizons:
+        simulation = build_simulation(
+            seed, "array", arrival_rate=arrival_rate, simulation_time=horizon
+        )
+        start = time.perf_counter()
+        simulation.run()
+        rows.append((horizon, simulation.n_appliances, time.perf_counter() - start))
+
+    appliances = np.array([row[1] for row in rows], dtype=float)
+    seconds = np.array([row[2] for row in rows])
+    exponent = np.polyfit(np.log(appliances), np.log(seconds), 1)[0]
+    return rows, exponent
+
+
+# |-------------------|
+# | Future event list |
+# |-------------------|
+
+
+def hold_benchmark(kind, population, operations=200_000, seed=0):
+    """
+    Classic hold model: keeps `population` pending events and repeats
+    operations times a pop followed by a push at an exponential delay after
+    the popped time. Returns the seconds per hold operation.
+    """
+    rng = np.random.default_rng(seed)
+    queue = make_event_list(kind)
+    for n, t in enumerate(rng.exponential(float(population), population).tolist()):
+        queue.push((t, n, 0, -1, -1))
+    delays = rng.exponential(float(population), operations).tolist()
+    sequence = population
+    start = time.perf_counter()
+    for delay in delays:
+        entry = queue.pop()
+        sequence += 1
+        queue.push((entry[0] + delay, sequence, 0, -1, -1))
+    return (time.perf_counter() - start) / operations
+
+
+# |------------|
+# | Event loop |
+# |------------|
+
+
+def time_handlers(simulation):
+    """
+    Runs the simulation with a Profiler attached.
+
+    Returns {label: {"count": events, "seconds": cumulative time}} with the
+    handlers named as the company used to call them (new_arrival,
+    classification_ended, ...). The timing itself slows the run down, so
+    events per second are measured on a separate, untimed run.
+    """
+    profiler = simulation.add_observer(Profiler())
+    simulation.run()
+    timings = {}
+    for label, entry in profiler.report().items():
+        name = "new_arrival" if label == "arrival" else f"{label[4:]}_ended"
+        timings[name] = {"count": entry["count"], "seconds": entry["seconds"]}
+    return timings
+
+
+def time_analysis(simulation, plot_limit):
+    # Time spent by every analysis step on the recorded run
+    from sim_stats import Statistics
+
+    timings = {}
+    start = time.perf_counter()
+    stats = Statistics(simulation.event_log, simulation.network)
+    stats.report()
+    timings["report"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stats.steady_state()
+    timings["steady_state"] = time.perf_counter() - start
+
+    if simulation.n_appliances <= plot_limit:
+        start = time.perf_counter()
+        stats.plot_timeline(io.BytesIO())
+        timings["plot_timeline"] = time.perf_counter() - start
+    return timings
+
+
+def run_case(arrival_rate, simulation_time, seed=0, plot_limit=200_000):
+    """
+    Benchmarks one configuration: events per second of a plain run, time per
+    handler, peak RSS of the process and time of the analysis layer. Meant
+    to run in a fresh process so that the peak RSS belongs to this case.
+    """
+    parameters = {"arrival_rate": arrival_rate, "simulation_time": simulation_time}
+
+    simulation = build_simulation(seed, "array", **parameters)
+    start = time.perf_counter()
+    simulation.run()
+    seconds = time.perf_counter() - start
+
+    handlers = time_handlers(build_simulation(seed, "array", **parameters))
+    events = sum(entry["count"] for entry in handlers.values())
+
+    return {
+        "arrival_rate": arrival_rate,
+        "simulation_time": simulation_time,
+        "appliances": simulation.n_appliances,
+        "events": events,
+        "seconds": seconds,
+        "events_per_second": events / seconds if seconds > 0 else 0.0,
+        "handlers": handlers,
+        "analysis": time_analysis(simulation, plot_limit),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(
+    arrival_rates=(6 / 60, 9 / 60, 12 / 60, 20 / 60),
+    simulation_times=(10_000, 100_000),
+    seed=0,
+    plot_limit=200_000,
+):
+    """
+    Runs run_case over the grid of arrival rates (the last two overload the
+    company) and horizons, every case in its own process.
+    """
+    cases = []
+    for arrival_rate in arrival_rates:
+        for simulation_time in simulation_times:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                cases.append(
+                    executor.submit(
+                        run_case, arrival_rate, simulation_time, seed, plot_limit
+                    ).result()
+                )
+    return {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "seed": seed,
+        "cases": cases,
+    }
+
+
+def compare(baseline, current, tolerance=0.10):
+    """
+    Compares the events per second of two suite results case by case.
+
+    Returns the rows (arrival_rate, simulation_time, before, after, ratio)
+    and whether any case lost more than tolerance of its throughput.
+    """
+    previous = {
+        (case["arrival_rate"], case["simulation_time"]): case
+        for case in baseline["cases"]
+    }
+    rows, regressed = [], False
+    for case in current["cases"]:
+        key = (case["arrival_rate"], case["simulation_time"])
+        if key not in previous:
+            continue
+        before = previous[key]["events_per_second"]
+        after = case["events_per_second"]
+        ratio = after / before if before > 0 else np.inf
+        regressed = regressed or ratio < 1 - tolerance
+        rows.append((*key, before, after, ratio))
+    return rows, regressed
+
+
+def _print_suite(result):
+    print(
+        f"{'rate/h':>7} {'horizon':>9} {'events':>9} {'events/s':>10}"
+        f" {'rss MB':>8} {'report s':>9}"
+    )
+    for case in result["cases"]:
+        print(
+            f"{60 * case['arrival_rate']:>7.1f} {case['simulation_time']:>9}"
+            f" {case['events']:>9} {case['events_per_second']:>10.0f}"
+            f" {case['peak_rss_kb'] / 1024:>8.1f} {case['analysis']['report']:>9.3f}"
+        )
+        total = sum(entry["seconds"] for entry in case["handlers"].values())
+        for label, entry in sorted(case["handlers"].items()):
+            share = entry["seconds"] / total if total > 0 else 0
+            print(f"{'':>18} {label:<28} {entry['count']:>9} {share:>7.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the simulation")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    suite = commands.add_parser("suite", help="run the benchmark grid")
+    suite.add_argument("--output", default="benchmark.json")
+    suite.add_argument("--seed", type=int, default=0)
+    suite.add_argument("--rates", type=float, nargs="+", help="arrivals per hour")
+    suite.add_argument("--horizons", type=float, nargs="+", help="simulation times")
+
+    commands.add_parser("scaling", help="check linear scaling under overload")
+
+    holds = commands.add_parser("event-lists", help="hold model of the event lists")
+    holds.add_argument(
+        "--populations", type=int, nargs="+", default=[100, 10_000, 1_000_000]
+    )
+
+    comparison = commands.add_parser("compare", help="compare two suite results")
+    comparison.add_argument("baseline")
+    comparison.add_argument("current")
+    comparison.add_argument("--tolerance", type=float, default=0.10)
+
+    args = parser.parse_args()
+
+    if args.command == "suite":
+        options = {"seed": args.seed}
+        if args.rates:
+            options["arrival_rates"] = [rate / 60 for rate in args.rates]
+        if args.horizons:
+            options["simulation_times"] = args.horizons
+        result = run_suite(**options)
+        _print_suite(result)
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=2)
+        print(f"results written to {args.output}")
+
+    elif args.command == "scaling":
+        rows, exponent = overload_scaling()
+        print(f"{'horizon':>10} {'appliances':>12} {'seconds':>10} {'us/appliance':>14}")
+        for horizon, appliances, seconds in rows:
+            print(
+                f"{horizon:>10} {appliances:>12} {seconds:>10.3f}"
+                f" {1e6 * seconds / appliances:>14.1f}"
+            )
+        print(f"scaling exponent: {exponent:.2f}")
+
+        # Quadratic queues would give an exponent close to 2
+        sys.exit(0 if exponent < 1.15 else 1)
+
+    elif args.command == "event-lists":
+        print(f"{'population':>11}" + "".join(f" {kind:>12}" for kind in EVENT_LISTS))
+        for population in args.populations:
+            row = [
+                1e6 * hold_benchmark(kind, population) for kind in EVENT_LISTS
+            ]
+            print(f"{population:>11}" + "".join(f" {us:>9.2f} us" for us in row))
+
+    else:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        with open(args.current) as file:
+            current = json.load(file)
+        rows, regressed = compare(baseline, current, args.tolerance)
+        print(f"{'rate/h':>7} {'horizon':>9} {'before':>10} {'after':>10} {'ratio':>7}")
+        for rate, horizon, before, after, ratio in rows:
+            print(
+                f"{60 * rate:>7.1f} {horizon:>9} {before:>10.0f} {after:>10.0f}"
+                f" {ratio:>7.2f}"
+            )
+        sys.exit(1 if regressed else 0)
@@ -0,0 +1,83 @@
+import os
+import pickle
+import tempfile
+
+from sampling import Sampler, substreams
+
+
+CHECKPOINT_VERSION = 3
+
+
+def save_checkpoint(simulation, path):
+    """
+    Writes the whole state of a simulation to path: event queue, stage
+    queues and servers, clock, generator state, partially used sample blocks
+    and recorded statistics.
+
+    The file is written next to path and renamed over it, so an interrupted
+    write leaves the previous checkpoint intact. Service times given as
+    lambdas or other unpicklable functions cannot be checkpointed; use
+    distribution specs instead.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            pickle.dump(
+                {"version": CHECKPOINT_VERSION, "simulation": simulation},
+                file,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def load_checkpoint(path, seed=None):
+    """
+    Reads a simulation written by save_checkpoint. Calling its run() again
+    continues bit-identically to an uninterrupted run.
+
+    With a seed the generator is reseeded and the buffered samples are
+    dropped, so that several what-if branches can be forked from the same
+    warmed-up state and evolve independently.
+    """
+    with open(path, "rb") as file:
+        checkpoint = pickle.load(file)
+    if checkpoint.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(
+            f"Unsupported checkpoint version {checkpoint.get('version')!r} in {path}"
+        )
+    simulation = checkpoint["simulation"]
+    if seed is not None:
+        for stream, fresh in zip(
+            simulation.streams, substreams(seed, len(simulation.streams))
+        ):
+            stream.bit_generator.state = fresh.bit_generator.state
+        for sampler in (
+            *simulation.services,
+            simulation.interarrival,
+            *simulation.uniforms,
+        ):
+            if isinstance(sampler, Sampler):
+                sampler._values = iter(())
+    return simulation
+
+
+def run_with_checkpoints(simulation, path, every):
+    """
+    Runs the simulation to the end, saving a checkpoint to path every `every`
+    units of simulated time. Works the same on a simulation returned by
+    load_checkpoint, which picks up where the checkpoint was taken.
+    """
+    if every <= 0:
+        raise ValueError("every must be positive")
+    until = (simulation.time // every + 1) * every
+    while simulation.events_queue or not simulation.started:
+        simulation.run(until)
+        save_checkpoint(simulation, path)
+        until += every
+    return simulation
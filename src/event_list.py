@@ -0,0 +1,152 @@
+from functools import partial
+import heapq
+import math
+
+
+# |-------------|
+# | Event codes |
+# |-------------|
+
+# Entries of the future event list are tuples (time, sequence, code, stage,
+# server). The sequence number is unique and increasing, so simultaneous
+# events run in the order they were scheduled and tuples never compare
+# further than their second field.
+ARRIVAL = 0
+END_SERVICE = 1
+
+EVENT_NAMES = {ARRIVAL: "arrival", END_SERVICE: "end_service"}
+
+
+class HeapEventList(list):
+    """
+    Binary heap of event entries: O(log n) push and pop, both running in C.
+    The default future event list.
+    """
+
+    def __init__(self, entries=()):
+        super().__init__(entries)
+        heapq.heapify(self)
+        self._bind()
+
+    def _bind(self):
+        # heapq called directly on the list, without a Python frame per call
+        self.push = partial(heapq.heappush, self)
+        self.pop = partial(heapq.heappop, self)
+
+    def peek_time(self):
+        """Time of the next event (the list must not be empty)."""
+        return self[0][0]
+
+    def __reduce__(self):
+        return type(self), (list(self),)
+
+
+class CalendarQueue:
+    """
+    Calendar queue (Brown, 1988): the time axis is cut in "days" of a fixed
+    width and the days are spread over a ring of buckets, each a small heap.
+    Pop scans from the current day for the first entry due on it, so push
+    and pop take O(1) amortized time as long as the width matches the
+    spacing of the events.
+
+    The number of buckets doubles (halves) when the population exceeds twice
+    (falls below half) the number of buckets, and the width is then
+    re-estimated from the spacing of the earliest pending events. It is also
+    re-estimated when pops start scanning many empty days on average, as
+    happens when the spacing of the events drifts away from the width.
+    """
+
+    def __init__(self, entries=(), n_buckets=16, width=1.0):
+        self._size = 0
+        self._rebuild(list(entries), n_buckets, width, 0.0)
+
+    def _rebuild(self, entries, n_buckets, width, now):
+        self.n_buckets = n_buckets
+        self.width = width
+        self.buckets = [[] for _ in range(n_buckets)]
+        self.day = int(now / width)
+        self.now = now
+        self._size = 0
+        # days scanned and pops since the last rebuild
+        self._scanned = 0
+        self._pops = 0
+        for entry in entries:
+            self.push(entry, resize=False)
+
+    def push(self, entry, resize=True):
+        heapq.heappush(
+            self.buckets[int(entry[0] / self.width) % self.n_buckets], entry
+        )
+        self._size += 1
+        if resize and self._size > 2 * self.n_buckets:
+            self._resize(2 * self.n_buckets)
+
+    def _next_bucket(self):
+        # Bucket holding the earliest entry, moving the current day to it
+        buckets, width, n = self.buckets, self.width, self.n_buckets
+        start = day = self.day
+        for _ in range(n):
+            bucket = buckets[day % n]
+            if bucket and int(bucket[0][0] / width) <= day:
+                self.day = day
+                self._scanned += day - start
+                return bucket
+            day += 1
+
+        # Nothing due within a whole year: jump to the earliest entry
+        bucket = min((b for b in buckets if b), key=lambda b: b[0])
+        self.day = int(bucket[0][0] / width)
+        self._scanned += n
+        return bucket
+
+    def pop(self):
+        if not self._size:
+            raise IndexError("pop from an empty event list")
+        entry = heapq.heappop(self._next_bucket())
+        self._size -= 1
+        self.now = entry[0]
+        self._pops += 1
+        if self.n_buckets > 16 and self._size < self.n_buckets // 2:
+            self._resize(self.n_buckets // 2)
+        elif self._pops >= self.n_buckets and self._scanned > 4 * self._pops:
+            # The width no longer fits the events: estimate it again
+            self._resize(self.n_buckets)
+        return entry
+
+    def peek_time(self):
+        """Time of the next event (the list must not be empty)."""
+        return self._next_bucket()[0][0]
+
+    def _resize(self, n_buckets):
+        entries = [entry for bucket in self.buckets for entry in bucket]
+        entries.sort()
+        # Width of about three average separations of the earliest events
+        times = [entry[0] for entry in entries[:25]]
+        gaps = [b - a for a, b in zip(times, times[1:]) if b > a]
+        width = 3 * sum(gaps) / len(gaps) if gaps else self.width
+        if not math.isfinite(width) or width <= 0:
+            width = self.width
+        self._rebuild(entries, n_buckets, width, self.now)
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+
+EVENT_LISTS = {"heap": HeapEventList, "calendar": CalendarQueue}
+
+
+def make_event_list(kind="heap"):
+    """
+    Returns an empty future event list: "heap", "calendar" or an existing
+    object with push(entry), pop(), peek_time() and len().
+    """
+    if isinstance(kind, str):
+        if kind not in EVENT_LISTS:
+            raise ValueError(
+                f"Unknown event list {kind!r}, expected one of {sorted(EVENT_LISTS)}"
+            )
+        return EVENT_LISTS[kind]()
+    return kind
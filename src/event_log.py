@@ -0,0 +1,166 @@
+import numpy as np
+
+
+# |-------------|
+# | Stage codes |
+# |-------------|
+
+SYSTEM = 0
+CLASSIFICATION = 1
+GENERAL_REPARATION = 2
+EXPERT_REPARATION = 3
+SHIPPING = 4
+
+STAGE_NAMES = {
+    CLASSIFICATION: "classification",
+    GENERAL_REPARATION: "general_reparation",
+    EXPERT_REPARATION: "expert_reparation",
+    SHIPPING: "shipping",
+}
+
+# |-------------|
+# | Event kinds |
+# |-------------|
+
+ARRIVE = 0  # the appliance enters the company (stage SYSTEM)
+WAIT = 1  # the appliance begins waiting at a stage
+BEGIN = 2  # the appliance begins being served at a stage
+DEPART = 3  # the appliance leaves the company (stage SYSTEM)
+
+# One row per stage transition: 16 bytes per row, no padding
+EVENT_DTYPE = np.dtype(
+    [
+        ("appliance_id", np.int32),
+        ("stage", np.int8),
+        ("kind", np.int8),
+        ("server", np.int16),
+        ("time", np.float64),
+    ]
+)
+
+# Layout of the statistics dicts returned by get_statistics():
+# (stage, kind) -> (key, mode) where mode is
+#   "value"  -> dict[i] = time (a later visit overwrites it)
+#   "list"   -> dict[i] = [time of the 1st visit, time of the 2nd visit, ...]
+#   "server" -> dict[i] = (time, server) (a later visit overwrites it)
+#   "server_list" -> dict[i] = [(time, server) of the 1st visit, ...]
+DICT_LAYOUT = {
+    (SYSTEM, ARRIVE): ("arrivals", "value"),
+    (CLASSIFICATION, WAIT): ("waiting_classification", "list"),
+    (CLASSIFICATION, BEGIN): ("classificated_at", "list"),
+    (GENERAL_REPARATION, WAIT): ("waiting_general_reparation", "list"),
+    (GENERAL_REPARATION, BEGIN): ("begin_general_reparation", "server_list"),
+    (EXPERT_REPARATION, WAIT): ("waiting_expert_reparation", "value"),
+    (EXPERT_REPARATION, BEGIN): ("begin_expert_reparation", "server"),
+    (SHIPPING, WAIT): ("waiting_shipping", "value"),
+    (SHIPPING, BEGIN): ("begin_shipping", "server"),
+    (SYSTEM, DEPART): ("departure", "value"),
+}
+
+
+class DictRecorder:
+    """
+    Records the stage transitions in one dict of floats, lists or
+    (time, server) tuples per statistic, as laid out in DICT_LAYOUT.
+    """
+
+    def __init__(self, layout=DICT_LAYOUT):
+        self.layout = layout
+        self.statistics = {key: {} for key, _ in layout.values()}
+
+    def record(self, appliance_id, stage, kind, time, server=-1):
+        key, mode = self.layout[stage, kind]
+        records = self.statistics[key]
+        if mode == "list":
+            if appliance_id in records:
+                records[appliance_id].append(time)
+            else:
+                records[appliance_id] = [time]
+        elif mode == "server":
+            records[appliance_id] = (time, server)
+        elif mode == "server_list":
+            if appliance_id in records:
+                records[appliance_id].append((time, server))
+            else:
+                records[appliance_id] = [(time, server)]
+        else:
+            records[appliance_id] = time
+
+    def to_statistics(self):
+        return self.statistics
+
+
+class EventLog:
+    """
+    Records the stage transitions as rows of a growable NumPy structured array
+    with EVENT_DTYPE.
+
+    Rows are buffered in a small Python list and copied into the array in
+    blocks, so appending stays cheap while the stored log only costs 16 bytes
+    per transition.
+    """
+
+    def __init__(self, capacity=1024, block_size=4096):
+        self._rows = np.empty(capacity, dtype=EVENT_DTYPE)
+        self._size = 0
+        self._pending = []
+        self.block_size = block_size
+
+    def record(self, appliance_id, stage, kind, time, server=-1):
+        self._pending.append((appliance_id, stage, kind, server, time))
+        if len(self._pending) >= self.block_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        block = np.array(self._pending, dtype=EVENT_DTYPE)
+        self._pending = []
+        end = self._size + len(block)
+        if end > len(self._rows):
+            capacity = max(end, 2 * len(self._rows))
+            rows = np.empty(capacity, dtype=EVENT_DTYPE)
+            rows[: self._size] = self._rows[: self._size]
+            self._rows = rows
+        self._rows[self._size : end] = block
+        self._size = end
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Wraps existing rows with EVENT_DTYPE, e.g. a read-only np.memmap of a
+        trace file, without copying them.
+        """
+        log = cls.__new__(cls)
+        log._rows = rows
+        log._size = len(rows)
+        log._pending = []
+        log.block_size = 4096
+        return log
+
+    def __len__(self):
+        return self._size + len(self._pending)
+
+    @property
+    def rows(self):
+        """Recorded rows, in the order they happened."""
+        self._flush()
+        return self._rows[: self._size]
+
+    def select(self, stage, kind):
+        """Rows of the given stage and event kind, in the order they happened."""
+        rows = self.rows
+        return rows[(rows["stage"] == stage) & (rows["kind"] == kind)]
+
+    @property
+    def nbytes(self):
+        return self.rows.nbytes
+
+    def to_statistics(self, layout=DICT_LAYOUT):
+        """
+        Builds the dict view returned by get_statistics() from the log.
+        """
+        recorder = DictRecorder(layout)
+        for appliance_id, stage, kind, server, time in self.rows.tolist():
+            recorder.record(appliance_id, stage, kind, time, server)
+        return recorder.to_statistics()
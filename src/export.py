@@ -0,0 +1,230 @@
+import os
+
+import numpy as np
+
+from event_log import DICT_LAYOUT, EVENT_DTYPE, EventLog, SYSTEM, WAIT, BEGIN, DEPART
+
+
+# One row per completed stage visit: when the appliance started waiting, when
+# its service began and when it left the stage
+VISIT_DTYPE = np.dtype(
+    [
+        ("appliance_id", np.int32),
+        ("stage", np.int8),
+        ("server", np.int16),
+        ("entered", np.float64),
+        ("begin", np.float64),
+        ("end", np.float64),
+    ]
+)
+
+# Formats by file extension. ".bin" is the raw EVENT_DTYPE / VISIT_DTYPE
+# records, readable with np.memmap; Parquet and Arrow need pyarrow.
+FORMATS = {
+    ".parquet": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+    ".csv": "csv",
+    ".bin": "binary",
+}
+
+
+def _trace_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(
+            f"Unknown trace format {extension!r}, expected one of {sorted(FORMATS)}"
+        )
+    return FORMATS[extension]
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as error:
+        raise ImportError(
+            "Parquet and Arrow traces need pyarrow; use a .csv or .bin path instead"
+        ) from error
+    return pyarrow
+
+
+class _TableWriter:
+    """Appends blocks of a structured dtype to a file, one row group each."""
+
+    def __init__(self, path, dtype):
+        self.path = path
+        self.dtype = dtype
+        self.format = _trace_format(path)
+        if self.format in ("parquet", "arrow"):
+            pa = _pyarrow()
+            self._schema = pa.schema(
+                [(name, pa.from_numpy_dtype(dtype[name])) for name in dtype.names]
+            )
+            if self.format == "parquet":
+                self._writer = pa.parquet.ParquetWriter(path, self._schema)
+            else:
+                self._writer = pa.ipc.new_file(path, self._schema)
+        else:
+            self._file = open(path, "wb" if self.format == "binary" else "w")
+            if self.format == "csv":
+                self._file.write(",".join(dtype.names) + "\n")
+
+    def write(self, block):
+        if self.format in ("parquet", "arrow"):
+            pa = _pyarrow()
+            table = pa.Table.from_arrays(
+                [pa.array(block[name]) for name in self.dtype.names],
+                schema=self._schema,
+            )
+            self._writer.write_table(table)
+        elif self.format == "binary":
+            block.tofile(self._file)
+        else:
+            formats = [
+                "%d" if self.dtype[name].kind == "i" else "%.17g"
+                for name in self.dtype.names
+            ]
+            np.savetxt(self._file, block, fmt=formats, delimiter=",")
+
+    def close(self):
+        if self.format in ("parquet", "arrow"):
+            self._writer.close()
+        else:
+            self._file.close()
+
+
+class TraceWriter:
+    """
+    Recorder streaming every stage transition to a file instead of keeping
+    it, in row groups of row_group_size rows, so memory stays bounded
+    however long the run.
+
+    The format follows the extension of path: .parquet, .arrow / .feather
+    (both need pyarrow), .csv, or .bin for raw EVENT_DTYPE records. With
+    visits_path, one row per completed stage visit (VISIT_DTYPE) is streamed
+    there as well, which is usually what offline queries want.
+
+    Use as a simulation recorder and close it (or use it as a context
+    manager) when the run ends; load_trace reads the events back.
+    """
+
+    def __init__(self, path, visits_path=None, row_group_size=65536):
+        self.path = path
+        self.visits_path = visits_path
+        self.row_group_size = row_group_size
+        self._events = _TableWriter(path, EVENT_DTYPE)
+        self._pending = []
+        self.n_rows = 0
+        self.closed = False
+        if visits_path is not None:
+            self._visits = _TableWriter(visits_path, VISIT_DTYPE)
+            self._pending_visits = []
+            # in_flight[i] = [stage, server, entered, begin] of the current visit
+            self._in_flight = {}
+
+    def record(self, appliance_id, stage, kind, time, server=-1):
+        self._pending.append((appliance_id, stage, kind, server, time))
+        if len(self._pending) >= self.row_group_size:
+            self._flush()
+        if self.visits_path is None:
+            return
+
+        if kind == WAIT:
+            self._leave_stage(appliance_id, time)
+            self._in_flight[appliance_id] = [stage, -1, time, np.nan]
+        elif kind == BEGIN:
+            current = self._in_flight[appliance_id]
+            current[1] = server
+            current[3] = time
+        elif stage == SYSTEM and kind == DEPART:
+            self._leave_stage(appliance_id, time)
+
+    def _leave_stage(self, appliance_id, time):
+        current = self._in_flight.pop(appliance_id, None)
+        if current is None:
+            return
+        stage, server, entered, begin = current
+        self._pending_visits.append((appliance_id, stage, server, entered, begin, time))
+        if len(self._pending_visits) >= self.row_group_size:
+            self._flush_visits()
+
+    def _flush(self):
+        if self._pending:
+            self._events.write(np.array(self._pending, dtype=EVENT_DTYPE))
+            self.n_rows += len(self._pending)
+            self._pending = []
+
+    def _flush_visits(self):
+        if self._pending_visits:
+            self._visits.write(np.array(self._pending_visits, dtype=VISIT_DTYPE))
+            self._pending_visits = []
+
+    def close(self):
+        """
+        Writes the last row groups and closes the files. Visits still in
+        progress are left out of the visits file.
+        """
+        if self.closed:
+            return
+        self._flush()
+        self._events.close()
+        if self.visits_path is not None:
+            self._flush_visits()
+            self._visits.close()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.n_rows + len(self._pending)
+
+    def to_statistics(self, layout=DICT_LAYOUT):
+        """Closes the trace and builds the dict view from the file."""
+        self.close()
+        return load_trace(self.path).to_statistics(layout)
+
+
+def load_table(path, dtype):
+    """
+    Reads a trace file written by TraceWriter as a structured array of dtype.
+    Raw .bin files are memory-mapped without reading them, so a trace larger
+    than memory can still be opened; Parquet and Arrow files are read through
+    a memory map and copied into the array.
+    """
+    trace_format = _trace_format(path)
+    if trace_format == "binary":
+        if os.path.getsize(path) == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+    if trace_format == "csv":
+        return np.loadtxt(path, dtype=dtype, delimiter=",", skiprows=1, ndmin=1)
+
+    pa = _pyarrow()
+    if trace_format == "parquet":
+        table = pa.parquet.read_table(path, memory_map=True)
+    else:
+        with pa.memory_map(path) as source:
+            table = pa.ipc.open_file(source).read_all()
+    rows = np.empty(table.num_rows, dtype=dtype)
+    for name in dtype.names:
+        rows[name] = table.column(name).to_numpy()
+    return rows
+
+
+def load_trace(path):
+    """
+    Reads the events of a trace as an EventLog, which Statistics accepts
+    directly: Statistics(load_trace("run.bin")).
+    """
+    return EventLog.from_rows(load_table(path, EVENT_DTYPE))
+
+
+def load_visits(path):
+    """Reads the visits file of a trace as a VISIT_DTYPE structured array."""
+    return load_table(path, VISIT_DTYPE)
@@ -0,0 +1,108 @@
+import json
+
+
+# Observers are callables attached with NetworkSimulation.add_observer() and
+# called after every dispatched event as
+#
+#     observer(simulation, event, args, start, elapsed)
+#
+# with the event code (see event_list) and its (stage, server) arguments, the
+# perf_counter() value when the handler started and its wall-clock duration
+# in seconds. simulation.event_label(event, args) gives a readable name.
+# Without observers the simulation loop does not time anything.
+
+
+class Profiler:
+    """
+    Observer counting the dispatched events and their cumulative handler
+    time per event label, and sampling the size of the future event list
+    every sample_every events.
+    """
+
+    def __init__(self, sample_every=1000):
+        self.sample_every = sample_every
+        self.counts = {}
+        self.seconds = {}
+        self.heap_sizes = []  # (simulated time, pending events)
+        self.n_events = 0
+
+    def __call__(self, simulation, event, args, start, elapsed):
+        label = simulation.event_label(event, args)
+        self.counts[label] = self.counts.get(label, 0) + 1
+        self.seconds[label] = self.seconds.get(label, 0.0) + elapsed
+        if self.n_events % self.sample_every == 0:
+            self.heap_sizes.append((simulation.time, len(simulation.events_queue)))
+        self.n_events += 1
+
+    def report(self):
+        """Returns {label: {"count", "seconds", "mean_us"}}."""
+        return {
+            label: {
+                "count": count,
+                "seconds": self.seconds[label],
+                "mean_us": 1e6 * self.seconds[label] / count,
+            }
+            for label, count in self.counts.items()
+        }
+
+
+class ChromeTrace:
+    """
+    Observer collecting the dispatched events in the Chrome trace event
+    format, which chrome://tracing and https://ui.perfetto.dev can open.
+
+    Every event becomes a complete ("X") slice named after its label, with
+    the simulated time in its args, and the size of the future event list is
+    written as a counter track. To keep long runs manageable only one event
+    in every `every` is kept, and at most max_events of them.
+    """
+
+    def __init__(self, every=1, max_events=1_000_000):
+        self.every = every
+        self.max_events = max_events
+        self.trace_events = []
+        self.dropped = 0
+        self._seen = 0
+        self._origin = None
+
+    def __call__(self, simulation, event, args, start, elapsed):
+        self._seen += 1
+        if (self._seen - 1) % self.every:
+            return
+        if len(self.trace_events) >= 2 * self.max_events:
+            self.dropped += 1
+            return
+        if self._origin is None:
+            self._origin = start
+        timestamp = 1e6 * (start - self._origin)
+        self.trace_events.append(
+            {
+                "name": simulation.event_label(event, args),
+                "ph": "X",
+                "ts": timestamp,
+                "dur": 1e6 * elapsed,
+                "pid": 1,
+                "tid": 1,
+                "args": {"time": simulation.time},
+            }
+        )
+        self.trace_events.append(
+            {
+                "name": "pending events",
+                "ph": "C",
+                "ts": timestamp,
+                "pid": 1,
+                "args": {"pending": len(simulation.events_queue)},
+            }
+        )
+
+    def save(self, path):
+        with open(path, "w") as file:
+            json.dump(
+                {
+                    "traceEvents": self.trace_events,
+                    "displayTimeUnit": "ms",
+                    "otherData": {"dropped_events": self.dropped},
+                },
+                file,
+            )
@@ -0,0 +1,337 @@
+import numpy as np
+
+
+class LockstepSimulation:
+    """
+    Simulates n_replications independent replications of an open network
+    (see network.Network) at once, holding the state of all of them in NumPy
+    arrays: clock, next arrival, completion time of every server, queue
+    lengths and FIFO queues. Every step processes the next event of every
+    replication that is not over, so the interpreter overhead of a step is
+    shared by the whole batch.
+
+    arrival_rate may be a scalar or one rate per replication, servers an
+    array (n_replications, n_stages) of server counts overriding the network
+    and service_scale an array of the same shape multiplying the service
+    times, so that one batch can screen many scenarios. Services must be
+    distribution specs; plain functions cannot be sampled in batches.
+
+    The replications follow the same model as NetworkSimulation and their
+    summaries agree in distribution, but the random numbers are drawn for
+    the whole batch from one generator, so individual sample paths differ.
+    """
+
+    def __init__(
+        self,
+        network,
+        arrival_rate,
+        simulation_time=1000,
+        n_replications=1000,
+        seed=None,
+        servers=None,
+        service_scale=None,
+    ):
+        K, S = n_replications, len(network.stages)
+        self.network = network
+        self.n_replications = K
+        self.simulation_time = simulation_time
+        self.rng = np.random.default_rng(seed)
+        self.entry = network.index[network.entry]
+
+        self.arrival_rate = np.broadcast_to(
+            np.asarray(arrival_rate, dtype=float), (K,)
+        ).copy()
+        if servers is None:
+            servers = [stage.servers for stage in network.stages]
+        self.servers = np.broadcast_to(np.asarray(servers, dtype=np.int64), (K, S)).copy()
+        if (self.servers < 1).any():
+            raise ValueError("Every stage needs at least one server")
+        self.service_scale = (
+            np.ones((K, S))
+            if service_scale is None
+            else np.broadcast_to(np.asarray(service_scale, dtype=float), (K, S)).copy()
+        )
+
+        # Services: ("exponential", mean) specs are drawn as unit exponentials
+        # times the mean for all stages at once, other specs stage by stage
+        self.specs = []
+        for stage in network.stages:
+            if callable(stage.service):
+                raise ValueError(
+                    f"Stage {stage.name!r} needs a distribution spec, not a function"
+                )
+            method, *parameters = stage.service
+            if method.startswith("_") or not hasattr(self.rng, method):
+                raise ValueError(f"Unknown distribution {method!r}")
+            self.specs.append((method, parameters))
+        self.exponential_means = (
+            np.array([parameters[0] for _, parameters in self.specs], dtype=float)
+            if all(m == "exponential" and len(p) == 1 for m, p in self.specs)
+            else None
+        )
+
+        # Routing tables padded to a common width: targets (-1 to leave) and
+        # cumulative probabilities, padded with inf so they never match
+        tables = [network.routing_table(name) for name in network.names]
+        width = max(len(targets) for targets, _ in tables)
+        self.route_targets = np.full((S, width), -1, dtype=np.int64)
+        self.route_cumulative = np.full((S, width), np.inf)
+        for s, (targets, cumulative) in enumerate(tables):
+            self.route_targets[s, : len(targets)] = targets
+            self.route_cumulative[s, : len(cumulative)] = cumulative
+
+        # |-------|
+        # | State |
+        # |-------|
+
+        J = int(self.servers.max())
+        self.max_servers = J
+        self.time = np.zeros(K)
+        # Next event times: column 0 is the next arrival, column 1 + s * J + j
+        # the end of the service of server j of stage s (inf when idle)
+        self.next_event = np.full((K, 1 + S * J), np.inf)
+        # arrival time in the company of the appliance on every server
+        self.held = np.zeros((K, S * J))
+        self.busy = np.zeros((K, S), dtype=np.int64)
+        # FIFO queues as ring buffers of (arrival time, queue entry time)
+        self.capacity = 16
+        self.queue_arrival = np.zeros((K, S, self.capacity))
+        self.queue_entry = np.zeros((K, S, self.capacity))
+        self.head = np.zeros((K, S), dtype=np.int64)
+        self.queue_length = np.zeros((K, S), dtype=np.int64)
+
+        # |------------|
+        # | Statistics |
+        # |------------|
+
+        self.n_arrivals = np.zeros(K, dtype=np.int64)
+        self.n_departures = np.zeros(K, dtype=np.int64)
+        self.time_in_system = np.zeros(K)
+        self.wait_sum = np.zeros((K, S))
+        self.n_served = np.zeros((K, S), dtype=np.int64)
+        self.queue_area = np.zeros((K, S))
+        self.busy_area = np.zeros((K, S))
+        self.max_queue = np.zeros((K, S), dtype=np.int64)
+        self.n_steps = 0
+
+    # |--------|
+    # | Events |
+    # |--------|
+
+    def _schedule_arrivals(self, rows, now):
+        # Same rule as NetworkSimulation.next_arrival: none at or after closing
+        times = now + self.rng.exponential(1.0, len(rows)) / self.arrival_rate[rows]
+        times[now >= self.simulation_time] = np.inf
+        times[times >= self.simulation_time] = np.inf
+        self.next_event[rows, 0] = times
+
+    def _service_times(self, rows, stages):
+        if self.exponential_means is not None:
+            draws = self.rng.exponential(1.0, len(rows)) * self.exponential_means[stages]
+        else:
+            draws = np.empty(len(rows))
+            for s, (method, parameters) in enumerate(self.specs):
+                at_stage = stages == s
+                if at_stage.any():
+                    draws[at_stage] = getattr(self.rng, method)(
+                        *parameters, size=int(at_stage.sum())
+                    )
+        return draws * self.service_scale[rows, stages]
+
+    def _start(self, rows, stages, slots, arrivals, now):
+        # Servers (flat slots) of stages begin serving appliances now
+        J = self.max_servers
+        self.next_event[rows, 1 + stages * J + slots] = now + self._service_times(
+            rows, stages
+        )
+        self.held[rows, stages * J + slots] = arrivals
+
+    def _join(self, rows, stages, arrivals, now):
+        # Appliances arrive at stages: to an idle server or to the queue
+        J = self.max_servers
+        free = (self.queue_length[rows, stages] == 0) & (
+            self.busy[rows, stages] < self.servers[rows, stages]
+        )
+
+        r, s = rows[free], stages[free]
+        if len(r):
+            completions = self.next_event[r[:, None], 1 + s[:, None] * J + np.arange(J)]
+            idle = np.isinf(completions) & (np.arange(J) < self.servers[r, s][:, None])
+            # Lowest idle server, as in NetworkSimulation
+            self._start(r, s, idle.argmax(axis=1), arrivals[free], now[free])
+            self.busy[r, s] += 1
+            self.n_served[r, s] += 1
+
+        r, s = rows[~free], stages[~free]
+        if len(r):
+            if (self.queue_length[r, s] >= self.capacity).any():
+                self._grow_queues()
+            position = (self.head[r, s] + self.queue_length[r, s]) % self.capacity
+            self.queue_arrival[r, s, position] = arrivals[~free]
+            self.queue_entry[r, s, position] = now[~free]
+            self.queue_length[r, s] += 1
+            self.max_queue[r, s] = np.maximum(
+                self.max_queue[r, s], self.queue_length[r, s]
+            )
+
+    def _grow_queues(self):
+        # Doubles the ring buffers, unrolling every queue from its head
+        order = (self.head[..., None] + np.arange(self.capacity)) % self.capacity
+        for name in ("queue_arrival", "queue_entry"):
+            unrolled = np.take_along_axis(getattr(self, name), order, axis=2)
+            grown = np.zeros(unrolled.shape[:2] + (2 * self.capacity,))
+            grown[..., : self.capacity] = unrolled
+            setattr(self, name, grown)
+        self.head[:] = 0
+        self.capacity *= 2
+
+    def _complete(self, rows, slots, now):
+        # Services end: route the appliances, then refill or idle the servers
+        J = self.max_servers
+        stages = slots // J
+        arrivals = self.held[rows, slots]
+
+        u = self.rng.random(len(rows))
+        choice = (self.route_cumulative[stages] <= u[:, None]).sum(axis=1)
+        next_stages = self.route_targets[stages, choice]
+
+        queued = self.queue_length[rows, stages] > 0
+        r, s = rows[queued], stages[queued]
+        if len(r):
+            position = self.head[r, s]
+            waiting = self.queue_arrival[r, s, position]
+            self.wait_sum[r, s] += now[queued] - self.queue_entry[r, s, position]
+            self.head[r, s] = (position + 1) % self.capacity
+            self.queue_length[r, s] -= 1
+            self.n_served[r, s] += 1
+            self._start(r, s, slots[queued] - s * J, waiting, now[queued])
+        idle = ~queued
+        self.next_event[rows[idle], 1 + slots[idle]] = np.inf
+        self.busy[rows[idle], stages[idle]] -= 1
+
+        leaving = next_stages < 0
+        self.n_departures[rows[leaving]] += 1
+        self.time_in_system[rows[leaving]] += now[leaving] - arrivals[leaving]
+        staying = ~leaving
+        self._join(rows[staying], next_stages[staying], arrivals[staying], now[staying])
+
+    # |-----------------|
+    # | Simulation loop |
+    # |-----------------|
+
+    def run(self):
+        """Runs every replication until all its events are processed."""
+        K = self.n_replications
+        every = np.arange(K)
+        self._schedule_arrivals(every, self.time)
+        while True:
+            column = self.next_event.argmin(axis=1)
+            times = self.next_event[every, column]
+            active = np.isfinite(times)
+            if not active.any():
+                break
+            rows, column, now = every[active], column[active], times[active]
+
+            # Time-weighted integrals up to the event
+            elapsed = (now - self.time[rows])[:, None]
+            self.queue_area[rows] += self.queue_length[rows] * elapsed
+            self.busy_area[rows] += self.busy[rows] * elapsed
+            self.time[rows] = now
+
+            arriving = column == 0
+            arrived = rows[arriving]
+            self.n_arrivals[arrived] += 1
+            self._schedule_arrivals(arrived, now[arriving])
+            self._join(
+                arrived,
+                np.full(len(arrived), self.entry),
+                now[arriving],
+                now[arriving],
+            )
+            ending = ~arriving
+            self._complete(rows[ending], column[ending] - 1, now[ending])
+            self.n_steps += 1
+
+    def summary(self):
+        """
+        Returns a dict of arrays with one value per replication: arrivals,
+        departures, mean time in system and, per stage, the mean wait of the
+        started services, the utilization of the servers and the mean and max
+        queue length, all with the same names as the other summaries.
+        """
+        T = self.time
+        span = np.where(T > 0, T, np.nan)
+        summary = {
+            "n_arrivals": self.n_arrivals.astype(float),
+            "n_departures": self.n_departures.astype(float),
+            "time_in_system": np.divide(
+                self.time_in_system,
+                self.n_departures,
+                out=np.zeros(self.n_replications),
+                where=self.n_departures > 0,
+            ),
+        }
+        for s, name in enumerate(self.network.names):
+            summary[f"wait_{name}"] = np.divide(
+                self.wait_sum[:, s],
+                self.n_served[:, s],
+                out=np.zeros(self.n_replications),
+                where=self.n_served[:, s] > 0,
+            )
+            summary[f"utilization_{name}"] = np.nan_to_num(
+                self.busy_area[:, s] / (self.servers[:, s] * span)
+            )
+            summary[f"queue_length_{name}"] = np.nan_to_num(self.queue_area[:, s] / span)
+            summary[f"max_queue_length_{name}"] = self.max_queue[:, s].astype(float)
+        return summary
+
+
+def lockstep_replications(n_replications, seed=None, **parameters):
+    """
+    Runs n_replications of the company in one LockstepSimulation and returns
+    its summary. Parameters are named as in replication.DEFAULT_PARAMETERS
+    and each may be a scalar or an array with one value per replication,
+    e.g. general_reparation_servers=np.repeat([3, 4], 500) screens two
+    staffings with 500 replications each.
+    """
+    from network import company_network
+    from replication import DEFAULT_PARAMETERS
+
+    unknown = set(parameters) - set(DEFAULT_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown parameters {sorted(unknown)}")
+    params = dict(DEFAULT_PARAMETERS, **parameters)
+    if params["variates"] != "native":
+        raise ValueError("The lockstep engine only draws native variates")
+    if np.ndim(params["simulation_time"]):
+        raise ValueError("simulation_time must be the same for every replication")
+
+    network = company_network()
+    names = network.names
+    means = np.array(
+        [[stage.service[1]] for stage in network.stages], dtype=float
+    ).T
+    simulation = LockstepSimulation(
+        network,
+        params["arrival_rate"],
+        params["simulation_time"],
+        n_replications,
+        seed,
+        servers=np.stack(
+            np.broadcast_arrays(
+                *(np.asarray(params[f"{name}_servers"]) for name in names),
+                np.empty(n_replications),
+            )[:-1],
+            axis=-1,
+        ),
+        service_scale=np.stack(
+            np.broadcast_arrays(
+                *(np.asarray(params[f"{name}_mean"], dtype=float) for name in names),
+                np.empty(n_replications),
+            )[:-1],
+            axis=-1,
+        )
+        / means,
+    )
+    simulation.run()
+    return simulation.summary()
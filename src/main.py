@@ -1,59 +1,334 @@
-from simulation import ReparationCompanySimulation as Simulation
+import argparse
+import json
+import math
+import sys
 
-from sim_stats import Statistics
+from replication import (
+    DEFAULT_PARAMETERS,
+    build_simulation,
+    confidence_interval,
+    run_replications,
+)
 
-import numpy as np
 
-
-def run_simulation():
+def run_simulation(
+    arrival_rate=9 / 60, simulation_time=500, seed=None, **parameters
+):
     """
-    Run the simulation.
+    Run the simulation of the company and return it, with the distributions
+    of every stage as (Generator method, *parameters) specs.
     """
+    # Set the simulation parameters
+    # arrival_rate: 9 appliances per hour, simulation_time: time in minutes
+    simulation = build_simulation(
+        seed,
+        arrival_rate=arrival_rate,
+        simulation_time=simulation_time,
+        **parameters,
+    )
+
+    # Run the simulation
+    simulation.run()
+    return simulation
 
-    # Set function distributions for times on simulation
 
-    def classification_function():
-        return np.random.exponential(6)
+# |-----|
+# | CLI |
+# |-----|
 
-    def general_reparation_function():
-        return np.random.exponential(35)
 
-    def expert_reparation_function():
-        return np.random.exponential(65)
+def _parameters(args):
+    # Model parameters given on the command line, rates per hour
+    parameters = {"arrival_rate": args.rate / 60, "simulation_time": args.horizon}
+    for name in ("general_reparation", "expert_reparation"):
+        for suffix in ("servers", "mean"):
+            value = getattr(args, f"{name}_{suffix}", None)
+            if value is not None:
+                parameters[f"{name}_{suffix}"] = value
+    return parameters
 
-    def shipping_function():
-        return np.random.exponential(12.5)
 
-    # Set the simulation parameters
-    arrival_rate = 9 / 60  # 9 appliances per hour
-    simulation_time = 500  # time in minutes
+def _json_safe(value):
+    # Infinite and NaN floats (e.g. the measures of unstable stations) as
+    # null, since JSON has no representation for them
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(item) for item in value]
+    return value
+
+
+def _write(result, path):
+    # JSON to path, or to stdout without one
+    result = _json_safe(result)
+    if path is None:
+        json.dump(result, sys.stdout, indent=2, allow_nan=False)
+        print()
+    else:
+        with open(path, "w") as file:
+            json.dump(result, file, indent=2, allow_nan=False)
+
+
+def command_run(args):
+    from sim_stats import Statistics
+
+    recorder = "array"
+    if args.trace:
+        from export import TraceWriter
+
+        recorder = TraceWriter(args.trace, args.visits)
+    simulation = build_simulation(args.seed, recorder, **_parameters(args))
+    simulation.run()
+    if args.trace:
+        recorder.close()
+        from export import load_trace
+
+        log = load_trace(args.trace)
+    else:
+        log = simulation.event_log
 
-    # Create the simulation
-    simulation = Simulation(
-        arrival_rate,
-        classification_function,
-        general_reparation_function,
-        expert_reparation_function,
-        shipping_function,
-        simulation_time,
+    stats = Statistics(log, simulation.network)
+    if args.plot:
+        stats.plot_timeline(args.plot)
+    _write(
+        {"report": stats.report(), "utilization": simulation.get_utilization()},
+        args.output,
     )
 
-    # Run the simulation
+
+def command_replicate(args):
+    results = run_replications(
+        args.replications,
+        master_seed=args.seed,
+        max_workers=args.workers,
+        **_parameters(args),
+    )
+    summary = {}
+    for field, values in results.items():
+        mean, half_width = confidence_interval(values, args.confidence)
+        summary[field] = {"mean": mean, "half_width": half_width}
+    _write(
+        {
+            "summary": summary,
+            "replications": {
+                field: values.tolist() for field, values in results.items()
+            },
+        },
+        args.output,
+    )
+
+
+def command_sweep(args):
+    from sweep import run_sweep
+
+    grid = {"arrival_rate": [rate / 60 for rate in args.rates]}
+    for name in ("general_reparation", "expert_reparation"):
+        for suffix in ("servers", "mean"):
+            values = getattr(args, f"{name}_{suffix}")
+            if values:
+                grid[f"{name}_{suffix}"] = values
+    grid["simulation_time"] = [args.horizon]
+    rows, computed = run_sweep(
+        grid, args.replications, args.seed, args.cache, args.workers
+    )
+    print(
+        f"{computed} replications run, {len(rows) - computed} from the cache",
+        file=sys.stderr,
+    )
+    _write(rows, args.output)
+
+
+def command_analyze(args):
+    from export import load_trace
+    from sim_stats import Statistics
+
+    stats = Statistics(load_trace(args.trace))
+    result = {"report": stats.report()}
+    if args.steady_state:
+        result["steady_state"] = stats.steady_state()
+    if args.plot:
+        stats.plot_timeline(args.plot)
+    _write(result, args.output)
+
+
+def command_analytic(args):
+    from analytic import analytic_summary
+
+    _write(analytic_summary(**_parameters(args)), args.output)
+
+
+def command_optimize(args):
+    from optimizer import optimize_staffing
+
+    bounds = {
+        name: getattr(args, f"{name}_servers")
+        for name in ("general_reparation", "expert_reparation", "shipping")
+    }
+    result = optimize_staffing(
+        args.sla,
+        bounds,
+        seed=args.seed,
+        arrival_rate=args.rate / 60,
+        simulation_time=args.horizon,
+    )
+    print(f"{result['replications']} replications run", file=sys.stderr)
+    _write(result, args.output)
+
+
+def command_serve(args):
+    import asyncio
+
+    from service import WhatIfService
+
+    service = WhatIfService(args.workers, args.cache_size)
+    where = args.socket or f"http://{args.host}:{args.port}"
+    print(f"Serving what-if scenarios on {where}", file=sys.stderr)
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        pass
+
+
+def command_replay(args):
+    from network import company_network
+    from replay import intake_dtype, replay_company
+
+    simulation = replay_company(
+        args.intake,
+        args.seed,
+        "online",
+        simulation_time=args.horizon,
+        dtype=intake_dtype(company_network()),
+        use_categories=not args.sample_categories,
+        use_durations=not args.sample_services,
+        rebase=args.rebase,
+    )
     simulation.run()
+    _write(
+        {
+            "records": simulation.n_records,
+            "report": simulation.get_statistics(),
+            "utilization": simulation.get_utilization(),
+        },
+        args.output,
+    )
 
-    # Get the statistics
-    statistics = simulation.get_statistics()
 
-    # Create the Statistics object
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Simulation of the reparation company"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def model_arguments(command, many=False, seed=None):
+        nargs = "+" if many else None
+        command.add_argument("--seed", type=int, default=seed)
+        command.add_argument("--output", help="JSON output, stdout by default")
+        command.add_argument(
+            "--horizon",
+            type=float,
+            default=DEFAULT_PARAMETERS["simulation_time"],
+            help="simulation time in minutes",
+        )
+        for name in ("general_reparation", "expert_reparation"):
+            dashed = name.replace("_", "-")
+            command.add_argument(f"--{dashed}-servers", type=int, nargs=nargs)
+            command.add_argument(
+                f"--{dashed}-mean", type=float, nargs=nargs, help="minutes"
+            )
+
+    run = commands.add_parser("run", help="run one simulation and report it")
+    model_arguments(run)
+    run.add_argument("--rate", type=float, default=9, help="arrivals per hour")
+    run.add_argument(
+        "--trace", help="stream the events to a .csv, .bin, .parquet or .arrow file"
+    )
+    run.add_argument("--visits", help="stream the stage visits as well")
+    run.add_argument("--plot", help="save the timeline to this PNG/SVG file")
+    run.set_defaults(handler=command_run)
+
+    replicate = commands.add_parser("replicate", help="independent replications")
+    model_arguments(replicate)
+    replicate.add_argument("--rate", type=float, default=9, help="arrivals per hour")
+    replicate.add_argument("--replications", type=int, default=30)
+    replicate.add_argument("--workers", type=int, default=None)
+    replicate.add_argument("--confidence", type=float, default=0.95)
+    replicate.set_defaults(handler=command_replicate)
+
+    sweep = commands.add_parser("sweep", help="replications over a parameter grid")
+    model_arguments(sweep, many=True, seed=0)
+    sweep.add_argument("--rates", type=float, nargs="+", default=[9], help="per hour")
+    sweep.add_argument("--replications", type=int, default=10)
+    sweep.add_argument("--workers", type=int, default=None)
+    sweep.add_argument("--cache", default="sweep.sqlite")
+    sweep.set_defaults(handler=command_sweep)
+
+    analyze = commands.add_parser("analyze", help="report a recorded trace")
+    analyze.add_argument("trace")
+    analyze.add_argument("--output", help="JSON output, stdout by default")
+    analyze.add_argument("--steady-state", action="store_true")
+    analyze.add_argument("--plot", help="save the timeline to this PNG/SVG file")
+    analyze.set_defaults(handler=command_analyze)
 
-    stats = Statistics(statistics)
+    analytic = commands.add_parser(
+        "analytic", help="steady state of the exponential model, no simulation"
+    )
+    model_arguments(analytic)
+    analytic.add_argument("--rate", type=float, default=9, help="arrivals per hour")
+    analytic.set_defaults(handler=command_analytic)
+
+    optimize = commands.add_parser(
+        "optimize", help="cheapest staffing meeting a time-in-system SLA"
+    )
+    optimize.add_argument("--sla", type=float, required=True, help="minutes")
+    optimize.add_argument("--rate", type=float, default=9, help="arrivals per hour")
+    optimize.add_argument(
+        "--horizon",
+        type=float,
+        default=DEFAULT_PARAMETERS["simulation_time"],
+        help="simulation time in minutes",
+    )
+    optimize.add_argument("--seed", type=int, default=0)
+    optimize.add_argument("--output", help="JSON output, stdout by default")
+    for name in ("general_reparation", "expert_reparation", "shipping"):
+        optimize.add_argument(
+            f"--{name.replace('_', '-')}-servers",
+            type=int,
+            nargs="+",
+            default=list(range(1, 7)),
+            help="server counts to try",
+        )
+    optimize.set_defaults(handler=command_optimize)
 
-    stats.plot_timeline()
+    serve = commands.add_parser("serve", help="local what-if simulation service")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("--socket", help="serve on this Unix socket instead")
+    serve.add_argument("--workers", type=int, default=None)
+    serve.add_argument("--cache-size", type=int, default=256)
+    serve.set_defaults(handler=command_serve)
 
-    stats.plot_histogram()
+    replay = commands.add_parser("replay", help="replay a recorded intake file")
+    replay.add_argument(
+        "intake", help=".bin (replay.intake_dtype records), .csv, .parquet or .arrow"
+    )
+    replay.add_argument("--seed", type=int, default=None)
+    replay.add_argument("--output", help="JSON output, stdout by default")
+    replay.add_argument(
+        "--horizon", type=float, default=float("inf"), help="stop at this time"
+    )
+    replay.add_argument("--sample-categories", action="store_true")
+    replay.add_argument("--sample-services", action="store_true")
+    replay.add_argument(
+        "--rebase", action="store_true", help="start the clock at the first record"
+    )
+    replay.set_defaults(handler=command_replay)
 
-    # Calculate the statistics
+    return parser.parse_args(argv)
 
 
-# if __name__ == "__main__":
-run_simulation()
+if __name__ == "__main__":
+    args = parse_args()
+    args.handler(args)
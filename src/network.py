@@ -0,0 +1,183 @@
+import numpy as np
+
+from event_log import DICT_LAYOUT, SYSTEM, ARRIVE, WAIT, BEGIN, DEPART
+
+
+class Stage:
+    """
+    A service station of the network: a FIFO queue in front of a pool of
+    identical servers.
+
+    service is a distribution spec such as ("exponential", 35) or a
+    zero-argument function returning a service time.
+    """
+
+    def __init__(self, name, servers, service):
+        if servers < 1:
+            raise ValueError(f"Stage {name!r} needs at least one server")
+        self.name = name
+        self.servers = servers
+        self.service = service
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, {self.servers}, {self.service!r})"
+
+
+class Network:
+    """
+    Open queueing network made of stages, the stage every arrival enters and
+    a routing table.
+
+    routing[name] is a list of (next_stage, probability) pairs, compared in
+    order against one uniform draw when a service at that stage ends. A
+    next_stage of None, a missing entry or probabilities adding up to less
+    than one mean the appliance leaves the company.
+
+    layout is the layout of the statistics dicts (see event_log.DICT_LAYOUT);
+    by default every stage gets a "waiting_<name>" list of times and a
+    "begin_<name>" list of (time, server) tuples.
+    """
+
+    def __init__(self, stages, routing, entry, layout=None):
+        self.stages = list(stages)
+        self.names = [stage.name for stage in self.stages]
+        if len(set(self.names)) != len(self.names):
+            raise ValueError("Stage names must be unique")
+        self.index = {name: i for i, name in enumerate(self.names)}
+        if entry not in self.index:
+            raise ValueError(f"Unknown entry stage {entry!r}")
+        self.entry = entry
+        self.routing = {name: list(routing.get(name, [])) for name in self.names}
+        for name, routes in self.routing.items():
+            for next_stage, probability in routes:
+                if next_stage is not None and next_stage not in self.index:
+                    raise ValueError(f"Unknown stage {next_stage!r} in routing")
+                if probability < 0:
+                    raise ValueError(f"Negative routing probability from {name!r}")
+            if sum(p for _, p in routes) > 1 + 1e-9:
+                raise ValueError(f"Routing probabilities from {name!r} exceed 1")
+        self.layout = layout
+
+    def stage_code(self, name):
+        """Code of a stage in the event log: its position plus one (0 is SYSTEM)."""
+        return self.index[name] + 1
+
+    def routing_table(self, name):
+        """
+        Returns (targets, cumulative) for the stage: target stage indexes
+        (-1 to leave) and the cumulative probabilities compared against the
+        uniform draw.
+        """
+        targets, cumulative, total = [], [], 0.0
+        for next_stage, probability in self.routing[name]:
+            total += probability
+            targets.append(-1 if next_stage is None else self.index[next_stage])
+            cumulative.append(total)
+        if cumulative and abs(total - 1) < 1e-9:
+            cumulative[-1] = 1.0
+        elif total < 1:
+            targets.append(-1)
+            cumulative.append(1.0)
+        return tuple(targets), tuple(cumulative)
+
+    def routing_matrix(self):
+        """
+        Returns P with P[i, j] the probability of going from stage i to
+        stage j; what is missing from every row leaves the company.
+        """
+        P = np.zeros((len(self.stages), len(self.stages)))
+        for name, routes in self.routing.items():
+            for next_stage, probability in routes:
+                if next_stage is not None:
+                    P[self.index[name], self.index[next_stage]] += probability
+        return P
+
+    def dict_layout(self):
+        if self.layout is not None:
+            return self.layout
+        layout = {
+            (SYSTEM, ARRIVE): ("arrivals", "value"),
+            (SYSTEM, DEPART): ("departure", "value"),
+        }
+        for name in self.names:
+            code = self.stage_code(name)
+            layout[code, WAIT] = (f"waiting_{name}", "list")
+            layout[code, BEGIN] = (f"begin_{name}", "server_list")
+        return layout
+
+    def with_servers(self, **servers):
+        """Returns a copy of the network with other server counts per stage."""
+        return self._replace(servers, "servers")
+
+    def with_services(self, **services):
+        """Returns a copy of the network with other service distributions."""
+        return self._replace(services, "service")
+
+    def _replace(self, values, attribute):
+        unknown = set(values) - set(self.index)
+        if unknown:
+            raise ValueError(f"Unknown stages {sorted(unknown)}")
+        stages = []
+        for stage in self.stages:
+            fields = {
+                "servers": stage.servers,
+                "service": stage.service,
+                attribute: values.get(stage.name, getattr(stage, attribute)),
+            }
+            stages.append(Stage(stage.name, **fields))
+        return Network(stages, self.routing, self.entry, self.layout)
+
+    def __repr__(self):
+        return f"Network({self.stages!r}, entry={self.entry!r})"
+
+
+# |-------------------------|
+# | The company as a preset |
+# |-------------------------|
+
+COMPANY_SERVERS = {
+    "classification": 1,
+    "general_reparation": 3,
+    "expert_reparation": 4,
+    "shipping": 2,
+}
+
+COMPANY_ROUTING = {
+    # 17% go to shipping, 47,31% to general and 35,69% to expert reparations
+    "classification": [
+        ("shipping", 0.17),
+        ("general_reparation", 0.4731),
+        ("expert_reparation", 0.3569),
+    ],
+    # 5% go back to classification, 95% go to shipping
+    "general_reparation": [("classification", 0.05), ("shipping", 0.95)],
+    "expert_reparation": [("shipping", 1.0)],
+    "shipping": [],
+}
+
+
+def company_network(
+    classification_function=("exponential", 6),
+    general_reparation_function=("exponential", 35),
+    expert_reparation_function=("exponential", 65),
+    shipping_function=("exponential", 12.5),
+    servers=None,
+):
+    """
+    Returns the reparation company of the report as a Network: 1 classifier,
+    3 general technicians, 4 experts and 2 shipping ports unless servers
+    overrides some of the counts.
+    """
+    services = {
+        "classification": classification_function,
+        "general_reparation": general_reparation_function,
+        "expert_reparation": expert_reparation_function,
+        "shipping": shipping_function,
+    }
+    # The stage order matches the stage codes of event_log
+    stages = [
+        Stage(name, count, services[name])
+        for name, count in COMPANY_SERVERS.items()
+    ]
+    network = Network(stages, COMPANY_ROUTING, "classification", layout=DICT_LAYOUT)
+    return network.with_servers(**servers) if servers else network
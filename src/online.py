@@ -0,0 +1,233 @@
+from bisect import bisect_right, insort
+import math
+
+from event_log import SYSTEM, ARRIVE, WAIT, BEGIN, DEPART
+
+
+# |--------------|
+# | Accumulators |
+# |--------------|
+
+
+class Welford:
+    """Running count, mean and variance of a stream (Welford's algorithm)."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.max = -math.inf
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (x - self.mean)
+        if x > self.max:
+            self.max = x
+
+    @property
+    def variance(self):
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+
+class P2Quantile:
+    """
+    Running estimate of the p-quantile of a stream with the P² algorithm
+    (Jain and Chlamtac, 1985): five markers, constant memory.
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        q, n = self.heights, self.positions
+        if len(q) < 5:
+            insort(q, x)
+            return
+
+        # Cell k such that q[k] <= x < q[k + 1], stretching the extremes
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = bisect_right(q, x) - 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the middle markers towards their desired positions
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def _parabolic(self, i, d):
+        q, n = self.heights, self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    @property
+    def value(self):
+        q = self.heights
+        if not q:
+            return math.nan
+        if len(q) < 5:
+            # Too few observations for the markers: exact sample quantile
+            return q[min(len(q) - 1, int(self.p * len(q)))]
+        return q[2]
+
+
+class TimeWeighted:
+    """
+    Integral over time of a piecewise constant level, e.g. a queue length,
+    updated only when the level changes.
+    """
+
+    def __init__(self, time=0.0):
+        self.level = 0
+        self.max = 0
+        self.area = 0.0
+        self.start = time
+        self.last = time
+
+    def change(self, time, delta):
+        self.area += self.level * (time - self.last)
+        self.last = time
+        self.level += delta
+        if self.level > self.max:
+            self.max = self.level
+
+    def mean(self, until=None):
+        until = self.last if until is None else until
+        span = until - self.start
+        area = self.area + self.level * (until - self.last)
+        return area / span if span > 0 else 0.0
+
+
+# |----------|
+# | Recorder |
+# |----------|
+
+
+class OnlineRecorder:
+    """
+    Recorder feeding every stage transition straight into online
+    accumulators instead of keeping it.
+
+    Only the appliances still inside the company are remembered, and each is
+    forgotten as soon as it departs, so memory stays flat however long the
+    simulation runs. stage_names maps the stage codes to their names.
+    """
+
+    def __init__(self, stage_names, quantiles=(0.5, 0.9, 0.95)):
+        self.stage_names = dict(stage_names)
+        self.time_in_system = Welford()
+        self.time_in_system_quantiles = {p: P2Quantile(p) for p in quantiles}
+        self.waits = {code: Welford() for code in self.stage_names}
+        self.services = {code: Welford() for code in self.stage_names}
+        self.sojourns = {code: Welford() for code in self.stage_names}
+        self.queue_lengths = {code: TimeWeighted() for code in self.stage_names}
+        self.occupancy = {code: TimeWeighted() for code in self.stage_names}
+        self.in_system = TimeWeighted()
+        self.n_arrivals = 0
+        self.first_arrival = None
+        self.last_departure = None
+        self.last_time = 0.0
+
+        # in_flight[i] = [arrival, stage, begin of wait, begin of service]
+        self.in_flight = {}
+
+    def record(self, appliance_id, stage, kind, time, server=-1):
+        self.last_time = time
+        if kind == WAIT:
+            current = self.in_flight[appliance_id]
+            self._leave_stage(current, time)
+            current[1] = stage
+            current[2] = time
+            current[3] = None
+            self.queue_lengths[stage].change(time, 1)
+            self.occupancy[stage].change(time, 1)
+        elif kind == BEGIN:
+            current = self.in_flight[appliance_id]
+            current[3] = time
+            self.waits[stage].add(time - current[2])
+            self.queue_lengths[stage].change(time, -1)
+        elif stage == SYSTEM and kind == ARRIVE:
+            self.n_arrivals += 1
+            if self.first_arrival is None:
+                self.first_arrival = time
+            self.in_flight[appliance_id] = [time, None, None, None]
+            self.in_system.change(time, 1)
+        elif stage == SYSTEM and kind == DEPART:
+            current = self.in_flight.pop(appliance_id)
+            self._leave_stage(current, time)
+            time_in_system = time - current[0]
+            self.time_in_system.add(time_in_system)
+            for quantile in self.time_in_system_quantiles.values():
+                quantile.add(time_in_system)
+            self.in_system.change(time, -1)
+            self.last_departure = time
+
+    def _leave_stage(self, current, time):
+        # The service of the previous stage (if any) ends now
+        stage, entered, begun = current[1], current[2], current[3]
+        if stage is None:
+            return
+        self.services[stage].add(time - begun)
+        self.sojourns[stage].add(time - entered)
+        self.occupancy[stage].change(time, -1)
+
+    def to_statistics(self):
+        """
+        Returns the summary of the run, with the same metric names as
+        Statistics.report() plus standard deviations, maxima and quantiles.
+        """
+        T = self.last_time
+        span = (
+            self.last_departure - self.first_arrival
+            if self.last_departure is not None
+            else 0
+        )
+        summary = {
+            "n_arrivals": self.n_arrivals,
+            "n_departures": self.time_in_system.count,
+            "arrival_rate": self.n_arrivals / span if span > 0 else 0,
+            "time_in_system": self.time_in_system.mean,
+            "time_in_system_std": self.time_in_system.std,
+            "time_in_system_max": self.time_in_system.max,
+            "appliances_in_system": self.in_system.mean(T),
+        }
+        for p, quantile in self.time_in_system_quantiles.items():
+            summary[f"time_in_system_p{round(100 * p)}"] = quantile.value
+        for code, name in self.stage_names.items():
+            for metric, accumulators in (
+                ("wait", self.waits),
+                ("service", self.services),
+                ("sojourn", self.sojourns),
+            ):
+                summary[f"{metric}_{name}"] = accumulators[code].mean
+                summary[f"{metric}_{name}_std"] = accumulators[code].std
+            summary[f"appliances_in_{name}"] = self.occupancy[code].mean(T)
+            summary[f"queue_length_{name}"] = self.queue_lengths[code].mean(T)
+            summary[f"max_queue_length_{name}"] = self.queue_lengths[code].max
+        return summary
@@ -0,0 +1,281 @@
+from itertools import product
+
+import numpy as np
+
+from analytic import analytic_summary
+from lockstep import lockstep_replications
+from replication import DEFAULT_PARAMETERS
+
+
+# Cost of one server per stage, in arbitrary units per shift
+DEFAULT_COSTS = {
+    "classification": 1.0,
+    "general_reparation": 1.0,
+    "expert_reparation": 1.5,
+    "shipping": 0.5,
+}
+
+
+def staffing_candidates(bounds):
+    """
+    Returns every staffing of the grid bounds = {stage: server counts} as
+    dicts {stage: servers}, in the order of itertools.product.
+    """
+    names = list(bounds)
+    return [dict(zip(names, counts)) for counts in product(*bounds.values())]
+
+
+def staffing_cost(staffing, costs=DEFAULT_COSTS):
+    return sum(costs[name] * servers for name, servers in staffing.items())
+
+
+def _continuation(h2, variance, tolerance, r):
+    # Half width of the triangular continuation region after r observations
+    return np.maximum(0.0, h2 * variance / (2 * tolerance) - tolerance * r / 2)
+
+
+# |---------------------------------|
+# | Sequential procedures (batched) |
+# |---------------------------------|
+# simulate(systems, n) returns an array (len(systems), n) with n new
+# independent observations of every system. Observations are added in
+# batches of max(batch, r // 4) after r observations and the rules are
+# checked after each batch, which only makes the procedures more
+# conservative than their one-at-a-time versions while keeping the number
+# of (fixed-cost) calls to simulate logarithmic in the replications.
+
+
+def feasibility_check(
+    simulate, systems, threshold, tolerance, error=0.05, n0=20, batch=10,
+    max_replications=5000,
+):
+    """
+    Fully sequential feasibility check (Andradottir and Kim, 2010) of the
+    constraint mean <= threshold for every system. A system whose mean is
+    below threshold - tolerance is declared feasible, one above threshold +
+    tolerance infeasible, each with probability at least 1 - error; in
+    between either answer is acceptable.
+
+    Returns (feasible, observations): one bool per system and the
+    observations gathered for each. Systems still undecided after
+    max_replications are decided on their sample mean.
+    """
+    k = len(systems)
+    observations = list(simulate(systems, n0))
+    h2 = (n0 - 1) * ((2 * error) ** (-2 / (n0 - 1)) - 1)
+    variance = np.array([o.var(ddof=1) for o in observations])
+    feasible = [None] * k
+    while True:
+        open_systems = []
+        for i in range(k):
+            if feasible[i] is not None:
+                continue
+            r = len(observations[i])
+            width = _continuation(h2, variance[i], tolerance, r)
+            excess = observations[i].sum() - r * threshold
+            if excess <= -width:
+                feasible[i] = True
+            elif excess >= width:
+                feasible[i] = False
+            elif r >= max_replications:
+                feasible[i] = bool(observations[i].mean() <= threshold)
+            else:
+                open_systems.append(i)
+        if not open_systems:
+            return feasible, observations
+        r = max(len(observations[i]) for i in open_systems)
+        new = simulate([systems[i] for i in open_systems], max(batch, r // 4))
+        for i, values in zip(open_systems, new):
+            observations[i] = np.concatenate([observations[i], values])
+
+
+def kn_select(
+    simulate, systems, indifference, error=0.05, n0=20, batch=10,
+    max_replications=5000, observations=None,
+):
+    """
+    Kim and Nelson (2001) fully sequential selection of the system with the
+    smallest mean: with probability at least 1 - error it returns one whose
+    mean is within indifference of the best. Systems are eliminated as soon
+    as a rival is clearly better, so replications go to the competitive
+    ones only.
+
+    observations optionally gives observations already gathered for every
+    system (e.g. by feasibility_check); they are trimmed to a common count
+    and topped up to n0. Returns (index of the selected system, list of the
+    observations of every system).
+    """
+    k = len(systems)
+    if observations is None:
+        observations = [np.empty(0) for _ in systems]
+    r = min(len(o) for o in observations)
+    observations = [o[:r] for o in observations]
+    if r < n0:
+        new = simulate(systems, n0 - r)
+        observations = [np.concatenate([o, v]) for o, v in zip(observations, new)]
+    if k == 1:
+        return 0, observations
+    r = len(observations[0])
+
+    # Variances of the pairwise differences over the first-stage sample
+    first = np.array(observations)
+    n_first = len(first[0])
+    differences = first[:, None, :] - first[None, :, :]
+    variance = differences.var(axis=2, ddof=1)
+    eta = 0.5 * ((2 * error / (k - 1)) ** (-2 / (n_first - 1)) - 1)
+    h2 = 2 * eta * (n_first - 1)
+
+    alive = list(range(k))
+    while len(alive) > 1:
+        sums = {i: observations[i].sum() for i in alive}
+        survivors = []
+        for i in alive:
+            # i survives if no rival l is better by more than the region
+            if all(
+                sums[i] - sums[l] <= _continuation(h2, variance[i, l], indifference, r)
+                for l in alive
+                if l != i
+            ):
+                survivors.append(i)
+        alive = survivors
+        if len(alive) <= 1 or r >= max_replications:
+            break
+        step = max(batch, r // 4)
+        new = simulate([systems[i] for i in alive], step)
+        for i, values in zip(alive, new):
+            observations[i] = np.concatenate([observations[i], values])
+        r += step
+    best = min(alive, key=lambda i: observations[i].mean())
+    return best, observations
+
+
+# |-----------|
+# | Optimizer |
+# |-----------|
+
+
+def optimize_staffing(
+    sla,
+    bounds,
+    costs=DEFAULT_COSTS,
+    metric="time_in_system",
+    tolerance=None,
+    indifference=None,
+    error=0.05,
+    n0=20,
+    batch=10,
+    max_replications=2000,
+    prescreen=True,
+    seed=None,
+    **parameters,
+):
+    """
+    Cheapest staffing whose mean metric (a key of the lockstep summary,
+    time in system by default) meets sla, searched over the grid bounds =
+    {stage: server counts}; the other parameters are those of
+    replication.DEFAULT_PARAMETERS.
+
+    With prescreen, staffings the analytic solver finds unstable are
+    dropped without simulation. The others are visited by increasing cost:
+    the staffings of each cost level go through feasibility_check, and the
+    first level with feasible staffings is settled by kn_select on the
+    metric, so more expensive staffings are never simulated. Replications
+    run batched in the lockstep engine.
+
+    tolerance (default 5% of sla) is the indifference zone of the
+    constraint and indifference (default tolerance) that of the selection.
+    The error is split evenly between the feasibility checks (Bonferroni
+    over the screened grid) and the selection, so with probability at least
+    1 - error the result is feasible within tolerance, no cheaper staffing
+    has a mean below sla - tolerance, and it is within indifference of the
+    best staffing of its cost.
+
+    Returns a dict with the "best" staffing (None if nothing is feasible),
+    its "cost" and "mean", the total "replications" run and, for every
+    staffing, its cost, replications, mean and outcome ("unstable",
+    "feasible", "infeasible" or "not simulated") in "staffings".
+    """
+    unknown = set(bounds) - {
+        name[: -len("_servers")] for name in DEFAULT_PARAMETERS if name.endswith("_servers")
+    }
+    if unknown:
+        raise ValueError(f"Unknown stages {sorted(unknown)}")
+    if tolerance is None:
+        tolerance = 0.05 * sla
+    if indifference is None:
+        indifference = tolerance
+
+    candidates = staffing_candidates(bounds)
+    report = [
+        {
+            "staffing": staffing,
+            "cost": staffing_cost(staffing, costs),
+            "replications": 0,
+            "mean": None,
+            "outcome": "not simulated",
+        }
+        for staffing in candidates
+    ]
+    if prescreen:
+        for entry in report:
+            servers = {f"{name}_servers": n for name, n in entry["staffing"].items()}
+            if not analytic_summary(**dict(parameters, **servers))["stable"]:
+                entry["outcome"] = "unstable"
+    screened = [entry for entry in report if entry["outcome"] != "unstable"]
+
+    seeds = np.random.SeedSequence(seed)
+    replications = 0
+
+    def simulate(entries, n):
+        nonlocal replications
+        servers = {
+            f"{name}_servers": np.repeat(
+                [entry["staffing"][name] for entry in entries], n
+            )
+            for name in bounds
+        }
+        summary = lockstep_replications(
+            len(entries) * n, seeds.spawn(1)[0], **dict(parameters, **servers)
+        )
+        replications += len(entries) * n
+        for entry in entries:
+            entry["replications"] += n
+        return summary[metric].reshape(len(entries), n)
+
+    levels = {}
+    for entry in screened:
+        levels.setdefault(round(entry["cost"], 9), []).append(entry)
+    best = None
+    for cost in sorted(levels):
+        level = levels[cost]
+        feasible, observations = feasibility_check(
+            simulate, level, sla, tolerance, error / 2 / len(screened), n0, batch,
+            max_replications,
+        )
+        for entry, ok, values in zip(level, feasible, observations):
+            entry["outcome"] = "feasible" if ok else "infeasible"
+            entry["mean"] = float(values.mean())
+        passed = [i for i, ok in enumerate(feasible) if ok]
+        if passed:
+            chosen, values = kn_select(
+                simulate,
+                [level[i] for i in passed],
+                indifference,
+                error / 2,
+                n0,
+                batch,
+                max_replications,
+                [observations[i] for i in passed],
+            )
+            for i, v in zip(passed, values):
+                level[i]["mean"] = float(v.mean())
+            best = level[passed[chosen]]
+            break
+
+    return {
+        "best": None if best is None else best["staffing"],
+        "cost": None if best is None else best["cost"],
+        "mean": None if best is None else best["mean"],
+        "replications": replications,
+        "staffings": report,
+    }
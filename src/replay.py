@@ -0,0 +1,273 @@
+from itertools import islice
+import math
+
+import numpy as np
+
+from event_list import ARRIVAL, END_SERVICE
+from event_log import SYSTEM, ARRIVE, WAIT, BEGIN
+from export import _TableWriter, _pyarrow, _trace_format, load_table
+from simulation import NetworkSimulation
+
+
+# Columns of an intake record: the arrival time (minutes), the category and,
+# per stage, the measured duration of the first service there (NaN when
+# unknown). The category is the stage code (stage index plus one) the
+# appliance goes to after the entry stage, 0 when it leaves from there
+# directly and -1 when unknown.
+def intake_dtype(network, durations=True):
+    """Structured dtype of the intake records of network."""
+    fields = [("time", np.float64), ("category", np.int8)]
+    if durations:
+        fields += [(f"service_{name}", np.float64) for name in network.names]
+    return np.dtype(fields)
+
+
+def save_intake(path, rows, block_size=65536):
+    """
+    Writes intake records (a structured array with intake_dtype fields) to
+    path, in any format of export.FORMATS.
+    """
+    writer = _TableWriter(path, rows.dtype)
+    try:
+        for start in range(0, len(rows), block_size):
+            writer.write(rows[start : start + block_size])
+    finally:
+        writer.close()
+
+
+def iter_intake(path, dtype=None, block_size=65536):
+    """
+    Yields the intake records of path as structured arrays of at most
+    block_size rows, without reading the file as a whole:
+
+    - .bin files are memory-mapped and sliced, and need dtype (raw records
+      carry no schema);
+    - .csv files are parsed block_size lines at a time;
+    - .parquet and .arrow / .feather files are read record batch by record
+      batch through a memory map (pyarrow).
+
+    The columns of .csv, .parquet and .arrow files are taken from the file.
+    """
+    trace_format = _trace_format(path)
+    if trace_format == "binary":
+        if dtype is None:
+            raise ValueError("Raw .bin intake files need their dtype")
+        rows = load_table(path, dtype)
+        for start in range(0, len(rows), block_size):
+            yield rows[start : start + block_size]
+
+    elif trace_format == "csv":
+        with open(path) as file:
+            names = file.readline().strip().split(",")
+            file_dtype = np.dtype(
+                [(name, np.int8 if name == "category" else np.float64) for name in names]
+            )
+            while True:
+                lines = list(islice(file, block_size))
+                if not lines:
+                    break
+                yield np.loadtxt(lines, dtype=file_dtype, delimiter=",", ndmin=1)
+
+    else:
+        pa = _pyarrow()
+        if trace_format == "parquet":
+            batches = pa.parquet.ParquetFile(path, memory_map=True).iter_batches(
+                block_size
+            )
+            yield from (_from_batch(batch) for batch in batches)
+        else:
+            with pa.memory_map(path) as source:
+                reader = pa.ipc.open_file(source)
+                for i in range(reader.num_record_batches):
+                    yield _from_batch(reader.get_batch(i))
+
+
+def _from_batch(batch):
+    # Arrow record batch to a structured array of the same columns
+    columns = {name: batch.column(name).to_numpy() for name in batch.schema.names}
+    rows = np.empty(
+        batch.num_rows, dtype=[(name, column.dtype) for name, column in columns.items()]
+    )
+    for name, column in columns.items():
+        rows[name] = column
+    return rows
+
+
+class ReplaySimulation(NetworkSimulation):
+    """
+    Network simulation driven by recorded intake (see intake_dtype) instead
+    of Poisson arrivals. Records are streamed from iter_intake and pulled one
+    at a time by the arrival event, so only the current block and the
+    appliances still in the network are held in memory, however long the
+    history.
+
+    Arrivals always come from the records. The category routes the
+    appliance out of the entry stage on its first pass and the service
+    columns give the duration of its first service at every stage; a
+    missing column, -1 / NaN values or use_categories / use_durations set
+    to False fall back to sampling, so recorded arrivals can be combined
+    with sampled routing and services. Later visits (feedback) are always
+    sampled.
+
+    intake is a path (read with iter_intake, dtype for .bin files) or any
+    iterable of record blocks. With rebase the clock starts at the first
+    arrival instead of at time 0. The run ends when the records are
+    exhausted or reach simulation_time.
+    """
+
+    def __init__(
+        self,
+        network,
+        intake,
+        simulation_time=math.inf,
+        seed=None,
+        recorder="dict",
+        block_size=1024,
+        variates="native",
+        event_list="heap",
+        dtype=None,
+        use_categories=True,
+        use_durations=True,
+        rebase=False,
+        intake_block_size=65536,
+    ):
+        # The rate is only used by the interarrival sampler, which replay
+        # does not call
+        super().__init__(
+            network,
+            1.0,
+            simulation_time,
+            seed,
+            recorder,
+            block_size,
+            variates,
+            event_list,
+        )
+        self.arrival_rate = None
+        self.blocks = (
+            iter_intake(intake, dtype, intake_block_size)
+            if isinstance(intake, str)
+            else iter(intake)
+        )
+        self.use_categories = use_categories
+        self.use_durations = use_durations
+        self.rebase = rebase
+        self.origin = None
+        self.last_time = -math.inf
+
+        # Current block as Python lists and the position in it
+        self.times = []
+        self.categories = []
+        self.durations = []
+        self.position = 0
+        self.n_records = 0
+
+        # recorded[appliance_id] = [category, duration per stage] of the
+        # appliances whose recorded values are not all used yet
+        self.recorded = {}
+
+    def _next_block(self):
+        # Loads the next non-empty block; False when the intake is exhausted
+        for block in self.blocks:
+            if not len(block):
+                continue
+            times = np.asarray(block["time"], dtype=float)
+            if self.origin is None:
+                self.origin = times[0] if self.rebase else 0.0
+            times = times - self.origin
+            if times[0] < 0:
+                raise ValueError("Intake records start before time 0, use rebase")
+            if (np.diff(times) < 0).any() or times[0] < self.last_time:
+                raise ValueError("Intake records must be sorted by time")
+            self.last_time = times[-1]
+            self.times = times.tolist()
+
+            names = block.dtype.names
+            n_stages = len(self.network.stages)
+            if self.use_categories and "category" in names:
+                categories = np.asarray(block["category"], dtype=np.int64)
+                if ((categories < -1) | (categories > n_stages)).any():
+                    raise ValueError(f"Categories must be in -1..{n_stages}")
+                self.categories = categories.tolist()
+            else:
+                self.categories = None
+            columns = [f"service_{name}" in names for name in self.network.names]
+            if self.use_durations and any(columns):
+                durations = np.full((len(block), n_stages), np.nan)
+                for k, name in enumerate(self.network.names):
+                    if columns[k]:
+                        durations[:, k] = block[f"service_{name}"]
+                if (durations < 0).any():
+                    raise ValueError("Service durations must be non-negative")
+                self.durations = durations.tolist()
+            else:
+                self.durations = None
+            self.position = 0
+            return True
+        return False
+
+    def next_arrival(self):
+        if self.position >= len(self.times) and not self._next_block():
+            return
+        time_arrival = self.times[self.position]
+        if time_arrival < self.simulation_time:
+            self.n_scheduled += 1
+            self.events_queue.push((time_arrival, self.n_scheduled, ARRIVAL, -1, -1))
+
+    def new_arrival(self, stage=-1, server=-1):  # event, arguments unused
+        appliance_id = self.n_appliances
+        self.n_appliances += 1
+        category = -1 if self.categories is None else self.categories[self.position]
+        durations = None if self.durations is None else self.durations[self.position]
+        if category >= 0 or durations is not None:
+            self.recorded[appliance_id] = [category, durations]
+        self.position += 1
+        self.n_records += 1
+
+        self.recorder.record(appliance_id, SYSTEM, ARRIVE, self.time)
+        self.recorder.record(appliance_id, self.entry + 1, WAIT, self.time)
+        self.dispatch(self.entry, appliance_id)
+        self.next_arrival()
+
+    def route(self, stage, appliance_id=-1):
+        recorded = self.recorded.get(appliance_id)
+        if recorded is not None and stage == self.entry and recorded[0] >= 0:
+            next_stage = recorded[0] - 1
+            recorded[0] = -1
+        else:
+            next_stage = super().route(stage)
+        if next_stage < 0:
+            self.recorded.pop(appliance_id, None)
+        return next_stage
+
+    def process(self, stage, server, appliance_id):
+        self.status[stage][server] = appliance_id
+        self.recorder.record(appliance_id, stage + 1, BEGIN, self.time, server)
+        recorded = self.recorded.get(appliance_id)
+        duration = math.nan
+        if recorded is not None and recorded[1] is not None:
+            duration = recorded[1][stage]
+            recorded[1][stage] = math.nan
+        if duration != duration:  # NaN: not recorded or already used
+            duration = self.services[stage]()
+        self.n_scheduled += 1
+        self.events_queue.push(
+            (self.time + duration, self.n_scheduled, END_SERVICE, stage, server)
+        )
+
+    def __getstate__(self):
+        raise TypeError("A replay streams its intake and cannot be checkpointed")
+
+
+def replay_company(intake, seed=None, recorder="dict", **options):
+    """
+    ReplaySimulation of the company network with the service distributions
+    of the report, which sample whatever the intake does not record.
+    options are those of ReplaySimulation (simulation_time, dtype,
+    use_categories, use_durations, rebase, ...).
+    """
+    from network import company_network
+
+    return ReplaySimulation(
+        company_network(), intake, seed=seed, recorder=recorder, **options
+    )
@@ -0,0 +1,317 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+import time
+
+import numpy as np
+
+from simulation import ReparationCompanySimulation as Simulation
+from sim_stats import Statistics
+
+
+# Parameters of the company described in the report (times in minutes)
+DEFAULT_PARAMETERS = {
+    "arrival_rate": 9 / 60,  # 9 appliances per hour
+    "classification_mean": 6,
+    "general_reparation_mean": 35,
+    "expert_reparation_mean": 65,
+    "shipping_mean": 12.5,
+    "simulation_time": 500,
+    "classification_servers": 1,
+    "general_reparation_servers": 3,
+    "expert_reparation_servers": 4,
+    "shipping_servers": 2,
+    # "native", or "inverse" / "antithetic" for antithetic pairs
+    "variates": "native",
+}
+
+# Compact per-replication summary sent back by every worker
+SUMMARY_FIELDS = (
+    "n_arrivals",
+    "n_departures",
+    "time_in_system",
+    "time_in_classification_node",
+    "wait_general_reparation",
+    "wait_expert_reparation",
+    "wait_shipping",
+    "utilization_classification",
+    "utilization_general_reparation",
+    "utilization_expert_reparation",
+    "utilization_shipping",
+)
+
+
+def replication_seeds(master_seed, start, stop):
+    """
+    Returns the SeedSequence of the replications start..stop-1.
+
+    The i-th replication always gets the i-th child of the master seed, so
+    results do not depend on how replications are spread over the workers.
+    """
+    master = (
+        master_seed
+        if isinstance(master_seed, np.random.SeedSequence)
+        else np.random.SeedSequence(master_seed)
+    )
+    return [
+        np.random.SeedSequence(master.entropy, spawn_key=master.spawn_key + (i,))
+        for i in range(start, stop)
+    ]
+
+
+def build_simulation(seed, recorder="dict", **parameters):
+    """
+    Builds a simulation whose arrivals, routing and service times all come from
+    the generator seeded with seed.
+    """
+    params = dict(DEFAULT_PARAMETERS, **parameters)
+    return Simulation(
+        params["arrival_rate"],
+        ("exponential", params["classification_mean"]),
+        ("exponential", params["general_reparation_mean"]),
+        ("exponential", params["expert_reparation_mean"]),
+        ("exponential", params["shipping_mean"]),
+        params["simulation_time"],
+        seed=seed,
+        recorder=recorder,
+        variates=params["variates"],
+        servers={
+            name: params[f"{name}_servers"]
+            for name in (
+                "classification",
+                "general_reparation",
+                "expert_reparation",
+                "shipping",
+            )
+        },
+    )
+
+
+def summarize(simulation):
+    """
+    Reduces one finished run to a row of SUMMARY_FIELDS.
+    """
+    statistics = simulation.get_statistics()
+    stats = Statistics(statistics)
+    utilization = simulation.get_utilization()
+    # Every stage wait is the mean over all its visits, zero waits included,
+    # as in Statistics.report() and the lockstep and analytic summaries
+    report = stats.report()
+    return np.array(
+        [
+            len(statistics["arrivals"]),
+            len(statistics["departure"]),
+            stats.average_time_in_system(),
+            stats.average_time_in_node_classification(),
+            report["wait_general_reparation"],
+            report["wait_expert_reparation"],
+            report["wait_shipping"],
+        ]
+        + [utilization[name]["utilization"] for name in simulation.network.names],
+        dtype=float,
+    )
+
+
+def _run_chunk(seeds, parameters):
+    # Worker entry point: only the summary rows travel back to the parent
+    rows = np.empty((len(seeds), len(SUMMARY_FIELDS)))
+    for k, seed in enumerate(seeds):
+        simulation = build_simulation(seed, **parameters)
+        simulation.run()
+        rows[k] = summarize(simulation)
+    return rows
+
+
+def _replicate(seeds, parameters, executor=None, chunksize=1):
+    # Runs the replications of seeds, in the pool if any, in seed order
+    chunks = [seeds[i : i + chunksize] for i in range(0, len(seeds), chunksize)]
+    if executor is None:
+        blocks = [_run_chunk(chunk, parameters) for chunk in chunks]
+    else:
+        blocks = list(executor.map(_run_chunk, chunks, [parameters] * len(chunks)))
+    return np.concatenate(blocks) if blocks else np.empty((0, len(SUMMARY_FIELDS)))
+
+
+def run_replications(
+    n_replications, master_seed=None, max_workers=None, chunksize=None, **parameters
+):
+    """
+    Runs n_replications independent replications over a process pool.
+
+    Returns a dict mapping every name in SUMMARY_FIELDS to an array with one
+    value per replication, in replication order. The output only depends on
+    master_seed, never on max_workers or chunksize.
+    """
+    seeds = replication_seeds(master_seed, 0, n_replications)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, -(-n_replications // (4 * max_workers)))
+
+    if max_workers == 1:
+        rows = _replicate(seeds, parameters, None, chunksize)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            rows = _replicate(seeds, parameters, executor, chunksize)
+    return {field: rows[:, j] for j, field in enumerate(SUMMARY_FIELDS)}
+
+
+def confidence_interval(values, confidence=0.95):
+    """Returns the mean and the Student-t half width of the values."""
+    from scipy import stats
+
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if n < 2:
+        return (float(values.mean()) if n else 0.0), np.inf
+    half_width = stats.t.ppf((1 + confidence) / 2, n - 1) * values.std(ddof=1) / np.sqrt(n)
+    return float(values.mean()), float(half_width)
+
+
+def run_until_precision(
+    metrics=("time_in_system",),
+    relative_precision=0.05,
+    confidence=0.95,
+    batch_size=None,
+    min_replications=10,
+    max_replications=10000,
+    max_seconds=None,
+    master_seed=None,
+    max_workers=None,
+    **parameters,
+):
+    """
+    Sequential experiment: launches replications in batches and updates the
+    Student-t interval of every metric (names of SUMMARY_FIELDS) after each
+    one, until every half width is within relative_precision of its mean, or
+    max_replications or max_seconds are spent.
+
+    Returns a dict with the number of replications run, whether every metric
+    converged, the per-replication results and, per metric, the mean, half
+    width and the number of replications it needed (None if never reached).
+    Replication i always uses seed i and batch_size (min_replications by
+    default) does not depend on max_workers, so a rerun with the same
+    master_seed stops at the same point whatever the number of workers.
+    """
+    unknown = set(metrics) - set(SUMMARY_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown metrics {sorted(unknown)}")
+    master = (
+        master_seed
+        if isinstance(master_seed, np.random.SeedSequence)
+        else np.random.SeedSequence(master_seed)
+    )
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    # The batches, hence the precision checks, must not depend on the
+    # number of workers; the workers split every batch between them
+    if batch_size is None:
+        batch_size = min_replications
+    chunksize = max(1, batch_size // (4 * max_workers))
+
+    started = time.perf_counter()
+    blocks = []
+    needed = dict.fromkeys(metrics)
+    summary = {}
+    executor = ProcessPoolExecutor(max_workers) if max_workers > 1 else None
+    try:
+        n = 0
+        while True:
+            stop = min(max(n + batch_size, min_replications), max_replications)
+            seeds = replication_seeds(master, n, stop)
+            blocks.append(_replicate(seeds, parameters, executor, chunksize))
+            n = stop
+            rows = np.concatenate(blocks)
+
+            for metric in metrics:
+                mean, half_width = confidence_interval(
+                    rows[:, SUMMARY_FIELDS.index(metric)], confidence
+                )
+                reached = half_width <= relative_precision * abs(mean)
+                if reached and needed[metric] is None:
+                    needed[metric] = n
+                summary[metric] = {
+                    "mean": mean,
+                    "half_width": half_width,
+                    "relative_half_width": half_width / abs(mean) if mean else np.inf,
+                    "reached": reached,
+                    "replications_needed": needed[metric],
+                }
+
+            converged = all(summary[metric]["reached"] for metric in metrics)
+            out_of_time = (
+                max_seconds is not None
+                and time.perf_counter() - started >= max_seconds
+            )
+            if converged or n >= max_replications or out_of_time:
+                break
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return {
+        "replications": n,
+        "converged": converged,
+        "results": {field: rows[:, j] for j, field in enumerate(SUMMARY_FIELDS)},
+        "metrics": summary,
+    }
+
+
+def compare_configurations(
+    first,
+    second,
+    n_replications,
+    metrics=("time_in_system",),
+    antithetic=False,
+    confidence=0.95,
+    master_seed=None,
+    max_workers=None,
+):
+    """
+    Compares two configurations (dicts of parameters overriding the
+    defaults) with common random numbers: replication i of both runs on the
+    same seed, so every purpose draws the same numbers in both.
+
+    With antithetic=True every replication is the average of an "inverse"
+    run and its "antithetic" twin, both on the same seed, which costs two
+    runs per replication and further cancels the noise.
+
+    Returns {metric: Statistics.paired_comparison(first, second)}.
+    """
+    unknown = set(metrics) - set(SUMMARY_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown metrics {sorted(unknown)}")
+    seeds = replication_seeds(master_seed, 0, n_replications)
+    variates = ("inverse", "antithetic") if antithetic else ("native",)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    chunksize = max(1, -(-n_replications // (4 * max_workers)))
+
+    executor = ProcessPoolExecutor(max_workers) if max_workers > 1 else None
+    try:
+        results = [
+            np.mean(
+                [
+                    _replicate(
+                        seeds,
+                        dict(configuration, variates=variate),
+                        executor,
+                        chunksize,
+                    )
+                    for variate in variates
+                ],
+                axis=0,
+            )
+            for configuration in (first, second)
+        ]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return {
+        metric: Statistics.paired_comparison(
+            results[0][:, SUMMARY_FIELDS.index(metric)],
+            results[1][:, SUMMARY_FIELDS.index(metric)],
+            confidence,
+        )
+        for metric in metrics
+    }
@@ -0,0 +1,105 @@
+import numpy as np
+
+
+# Inverse cumulative distribution functions applied to blocks of uniforms,
+# for the specs that can be sampled by inversion
+def _inverse_random(u):
+    return u
+
+
+def _inverse_uniform(u, low=0.0, high=1.0):
+    return low + (high - low) * u
+
+
+def _inverse_exponential(u, scale=1.0):
+    return -scale * np.log1p(-u)
+
+
+INVERSE = {
+    "random": _inverse_random,
+    "uniform": _inverse_uniform,
+    "exponential": _inverse_exponential,
+}
+
+VARIATES = ("native", "inverse", "antithetic")
+
+
+class Sampler:
+    """
+    Zero-argument callable returning one value of a distribution per call.
+
+    The distribution is given by a spec: a tuple (method, *parameters) naming
+    a numpy.random.Generator method, e.g. ("exponential", 35) or ("random",).
+    Values are drawn from the generator in blocks of block_size and handed out
+    one at a time, refilling the block lazily when it runs out.
+
+    With variates="inverse" the values are F^-1(u) of uniforms u of the
+    generator, and with variates="antithetic" they are F^-1(1 - u) of the
+    same uniforms, so that two runs on equal seeds are negatively correlated.
+    Both only work for the specs in INVERSE.
+    """
+
+    def __init__(self, spec, rng, block_size=1024, variates="native"):
+        method, *parameters = spec
+        draw = getattr(rng, method, None)
+        if draw is None or method.startswith("_"):
+            raise ValueError(f"Unknown distribution {method!r} in spec {spec!r}")
+        if variates not in VARIATES:
+            raise ValueError(f"variates must be one of {VARIATES}, not {variates!r}")
+        if variates != "native":
+            if method not in INVERSE:
+                raise ValueError(
+                    f"Distribution {method!r} cannot be sampled by inversion"
+                )
+            draw = self._invert
+
+        self.spec = tuple(spec)
+        self.rng = rng
+        self.block_size = block_size
+        self.variates = variates
+        self._draw = draw
+        self._parameters = parameters
+        self._values = iter(())
+
+    def __call__(self):
+        try:
+            return next(self._values)
+        except StopIteration:
+            block = self._draw(*self._parameters, size=self.block_size)
+            self._values = iter(block.tolist())
+            return next(self._values)
+
+    def _invert(self, *parameters, size):
+        u = self.rng.random(size)
+        if self.variates == "antithetic":
+            u = 1 - u
+        return INVERSE[self.spec[0]](u, *parameters)
+
+
+def make_sampler(spec, rng, block_size=1024, variates="native"):
+    """
+    Returns a Sampler for a distribution spec. Plain callables are returned
+    unchanged, since they cannot be sampled in blocks.
+    """
+    if callable(spec):
+        return spec
+    return Sampler(spec, rng, block_size, variates)
+
+
+def substreams(seed, n):
+    """
+    Returns n independent generators derived from seed (an int, None, a
+    SeedSequence or a Generator). The k-th generator only depends on seed and
+    k, so runs of different configurations on the same seed can give every
+    purpose (arrivals, the services of a stage, ...) the same random numbers.
+    """
+    if isinstance(seed, np.random.Generator):
+        seed = seed.bit_generator.seed_seq
+    elif not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return [
+        np.random.default_rng(
+            np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (k,))
+        )
+        for k in range(n)
+    ]
@@ -0,0 +1,307 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+from replication import (
+    DEFAULT_PARAMETERS,
+    SUMMARY_FIELDS,
+    _run_chunk,
+    confidence_interval,
+    replication_seeds,
+)
+from sweep import CACHE_VERSION
+
+
+# Largest request accepted: replications, servers per stage, expected
+# arrivals over all the replications (arrival_rate * simulation_time *
+# replications) and bytes of JSON body
+MAX_REPLICATIONS = 10_000
+MAX_SERVERS = 1000
+MAX_ARRIVALS = 5_000_000
+MAX_BODY = 1 << 20
+
+
+def _warm():
+    # Worker initializer: pay the imports and the first-run costs up front
+    _run_chunk(replication_seeds(0, 0, 1), {"simulation_time": 10})
+
+
+def _reject_constant(name):
+    # json.loads hook for Infinity, -Infinity and NaN
+    raise ValueError(f"{name} is not a valid number")
+
+
+def _ping():
+    return os.getpid()
+
+
+def scenario_key(parameters, replications, seed):
+    """Hash of a normalized scenario, used for the cache and for dedup."""
+    config = {
+        "version": CACHE_VERSION,
+        "parameters": parameters,
+        "replications": replications,
+        "seed": seed,
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+def normalize_scenario(scenario):
+    """
+    Validates scenario JSON, {"parameters": {...}, "replications": n,
+    "seed": s}, and returns (parameters with the defaults filled in,
+    replications, seed). Names are those of replication.DEFAULT_PARAMETERS.
+    The seed defaults to 0 so that identical scenarios give identical
+    results, which is what makes them cacheable.
+    """
+    if not isinstance(scenario, dict):
+        raise ValueError("A scenario must be a JSON object")
+    unknown = set(scenario) - {"parameters", "replications", "seed"}
+    if unknown:
+        raise ValueError(f"Unknown scenario fields {sorted(unknown)}")
+    parameters = scenario.get("parameters", {})
+    if not isinstance(parameters, dict):
+        raise ValueError("parameters must be a JSON object")
+    unknown = set(parameters) - set(DEFAULT_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown parameters {sorted(unknown)}")
+    for name, value in parameters.items():
+        if isinstance(DEFAULT_PARAMETERS[name], str):
+            if not isinstance(value, str):
+                raise ValueError(f"{name} must be a string")
+        elif isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"{name} must be a number")
+        elif not math.isfinite(value):
+            raise ValueError(f"{name} must be finite")
+        elif name.endswith("_servers") and value != int(value):
+            raise ValueError(f"{name} must be an integer")
+    parameters = dict(DEFAULT_PARAMETERS, **parameters)
+    for name, value in parameters.items():
+        if name.endswith("_servers"):
+            parameters[name] = int(value)
+            if not 1 <= parameters[name] <= MAX_SERVERS:
+                raise ValueError(f"{name} must be an integer in 1..{MAX_SERVERS}")
+        elif not isinstance(value, str):
+            parameters[name] = float(value)
+            if not value > 0:
+                raise ValueError(f"{name} must be positive")
+
+    replications = scenario.get("replications", 1)
+    seed = scenario.get("seed", 0)
+    if (
+        isinstance(replications, bool)
+        or not isinstance(replications, int)
+        or not 1 <= replications <= MAX_REPLICATIONS
+    ):
+        raise ValueError(f"replications must be an integer in 1..{MAX_REPLICATIONS}")
+    if isinstance(seed, bool) or not isinstance(seed, int) or seed < 0:
+        raise ValueError("seed must be a non-negative integer")
+    # One request must not hold a shared worker for long
+    arrivals = parameters["arrival_rate"] * parameters["simulation_time"] * replications
+    if arrivals > MAX_ARRIVALS:
+        raise ValueError(
+            f"The scenario expects {arrivals:.3g} arrivals, more than {MAX_ARRIVALS}"
+        )
+    return parameters, replications, seed
+
+
+class WhatIfService:
+    """
+    Long-lived what-if evaluator: scenarios are run on a pool of worker
+    processes started and warmed up once, identical scenarios in flight
+    share one computation and the results of the last cache_size scenarios
+    are kept in an LRU cache, so repeated queries are answered without
+    simulating.
+
+    evaluate() is a coroutine; serve() exposes it over HTTP or a Unix
+    socket. Replication i of a scenario always runs on seed i of its master
+    seed (see replication.replication_seeds), whatever the chunking.
+    """
+
+    def __init__(self, max_workers=None, cache_size=256, chunk_replications=8):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.cache_size = cache_size
+        self.chunk_replications = chunk_replications
+        self.executor = None
+        self._starting = None
+        self.cache = OrderedDict()
+        self.in_flight = {}
+        self.counters = {"requests": 0, "cache_hits": 0, "shared": 0, "computed": 0}
+
+    async def start(self):
+        """Starts the pool and waits until every worker has warmed up."""
+        if self._starting is None:
+            self._starting = asyncio.ensure_future(self._start_pool())
+        await asyncio.shield(self._starting)
+
+    async def _start_pool(self):
+        confidence_interval(np.arange(2.0))  # imports scipy in the parent
+        self.executor = ProcessPoolExecutor(self.max_workers, initializer=_warm)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(loop.run_in_executor(self.executor, _ping) for _ in range(self.max_workers))
+        )
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+            self._starting = None
+
+    async def evaluate(self, scenario):
+        """
+        Returns the summary of a scenario (see normalize_scenario): per
+        SUMMARY_FIELDS metric its mean and 95% half width over the
+        replications, plus "replications", "seconds" and whether it came
+        from the "cached" results.
+        """
+        parameters, replications, seed = normalize_scenario(scenario)
+        key = scenario_key(parameters, replications, seed)
+        self.counters["requests"] += 1
+
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.counters["cache_hits"] += 1
+            return dict(self.cache[key], cached=True)
+        if key in self.in_flight:
+            self.counters["shared"] += 1
+            result = await asyncio.shield(self.in_flight[key])
+            return dict(result, cached=False)
+
+        task = asyncio.ensure_future(self._compute(parameters, replications, seed))
+        self.in_flight[key] = task
+        try:
+            result = await asyncio.shield(task)
+        finally:
+            self.in_flight.pop(key, None)
+        self.cache[key] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return dict(result, cached=False)
+
+    async def _compute(self, parameters, replications, seed):
+        await self.start()
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        seeds = replication_seeds(seed, 0, replications)
+        size = self.chunk_replications
+        blocks = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    self.executor, _run_chunk, seeds[i : i + size], parameters
+                )
+                for i in range(0, replications, size)
+            )
+        )
+        rows = np.concatenate(blocks)
+        self.counters["computed"] += 1
+
+        summary = {}
+        for j, field in enumerate(SUMMARY_FIELDS):
+            mean, half_width = confidence_interval(rows[:, j])
+            summary[field] = {
+                "mean": mean,
+                "half_width": half_width if np.isfinite(half_width) else None,
+            }
+        return {
+            "summary": summary,
+            "replications": replications,
+            "seconds": time.perf_counter() - started,
+        }
+
+    def status(self):
+        return dict(
+            self.counters,
+            workers=self.max_workers,
+            cached_scenarios=len(self.cache),
+            in_flight=len(self.in_flight),
+        )
+
+    # |------|
+    # | HTTP |
+    # |------|
+    # POST /simulate with a scenario as JSON body, GET /status. Minimal
+    # HTTP/1.1 with keep-alive, enough for local dashboards and curl.
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY:
+                    await self._respond(writer, 413, {"error": "Body too large"})
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                status, result = await self._route(method, path, body)
+                await self._respond(writer, status, result)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, body):
+        if method == "GET" and path == "/status":
+            return 200, self.status()
+        if method != "POST" or path != "/simulate":
+            return 404, {"error": f"No route {method} {path}"}
+        try:
+            scenario = json.loads(body or b"{}", parse_constant=_reject_constant)
+            return 200, await self.evaluate(scenario)
+        except ValueError as error:
+            return 400, {"error": str(error)}
+        except Exception as error:
+            return 500, {"error": f"{type(error).__name__}: {error}"}
+
+    @staticmethod
+    async def _respond(writer, status, result):
+        reasons = {
+            200: "OK",
+            400: "Bad Request",
+            404: "Not Found",
+            413: "Payload Too Large",
+            500: "Internal Server Error",
+        }
+        body = json.dumps(result).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {reasons[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+
+    async def serve(self, host="127.0.0.1", port=8765, path=None):
+        """
+        Warms the pool up and serves HTTP on host:port, or on the Unix socket
+        path when given, until cancelled.
+        """
+        await self.start()
+        if path is not None:
+            server = await asyncio.start_unix_server(self._handle, path)
+        else:
+            server = await asyncio.start_server(self._handle, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.close()
@@ -1,5 +1,20 @@
-from scipy import stats
-import matplotlib.pyplot as plt
+import numpy as np
+
+from event_log import (
+    DICT_LAYOUT,
+    EVENT_DTYPE,
+    STAGE_NAMES,
+    SYSTEM,
+    CLASSIFICATION,
+    GENERAL_REPARATION,
+    EXPERT_REPARATION,
+    SHIPPING,
+    ARRIVE,
+    WAIT,
+    BEGIN,
+    DEPART,
+)
+from steady_state import steady_state_estimate
 
 
 class Statistics:
@@ -7,58 +22,231 @@ class Statistics:
     Class to calculate the statistics of the simulation.
     """
 
-    def __init__(self, statistics):
-        self.statistics = statistics
+    def __init__(self, statistics, network=None):
+        # statistics is either the dict returned by get_statistics() or an
+        # EventLog, in which case the dict view is only built if needed.
+        # network gives the stages and dict layout of runs of other networks
+        # than the company.
+        if network is None:
+            self.layout = DICT_LAYOUT
+            self.stage_names = STAGE_NAMES
+        else:
+            self.layout = network.dict_layout()
+            self.stage_names = {network.stage_code(name): name for name in network.names}
+        if hasattr(statistics, "to_statistics"):
+            self.event_log = statistics
+            self._statistics = None
+        else:
+            self.event_log = None
+            self._statistics = statistics
+        # Columns and metrics computed so far, see _table()
+        self._cache = {}
+
+    @property
+    def statistics(self):
+        if self._statistics is None:
+            self._statistics = self.event_log.to_statistics(self.layout)
+        return self._statistics
+
+    # |-----------------|
+    # | Columnar layout |
+    # |-----------------|
+
+    def _table(self):
+        """
+        Returns every stage transition as aligned arrays (appliance_id, stage,
+        kind, time, server), grouped by appliance and in chronological order
+        inside every group. It is built once and shared by all the metrics.
+        """
+        if "table" in self._cache:
+            return self._cache["table"]
+
+        if self.event_log is not None:
+            rows = self.event_log.rows
+            # The log is already chronological, so a stable sort by appliance
+            # keeps every group in order. Sorting (id, row) keys as plain
+            # integers is much cheaper than a stable argsort.
+            ids = rows["appliance_id"].astype(np.int64)
+            order = np.sort((ids << 32) | np.arange(len(rows))) & 0xFFFFFFFF
+            rows = rows[order]
+            table = {name: rows[name] for name in EVENT_DTYPE.names}
+            table["appliance_id"] = ids[order]
+        else:
+            parts = [
+                self._flatten(self.statistics.get(key, {}), mode, stage, kind)
+                for (stage, kind), (key, mode) in self.layout.items()
+            ]
+            table = {
+                name: np.concatenate([part[name] for part in parts])
+                for name in EVENT_DTYPE.names
+            }
+            order = np.lexsort((table["kind"], table["time"], table["appliance_id"]))
+            table = {name: column[order] for name, column in table.items()}
+
+        # Single small code per (stage, kind) pair to select rows with one test
+        table["code"] = table["stage"].astype(np.int16) * 4 + table["kind"]
+        self._cache["table"] = table
+        return table
+
+    @staticmethod
+    def _flatten(records, mode, stage, kind):
+        # One row per recorded time of a single statistics dict
+        if mode == "list":
+            lengths = np.fromiter(map(len, records.values()), np.int64, len(records))
+            ids = np.repeat(np.fromiter(records.keys(), np.int64, len(records)), lengths)
+            times = np.fromiter(
+                (t for visits in records.values() for t in visits), float, len(ids)
+            )
+            servers = np.full(len(ids), -1, np.int16)
+        elif mode == "server_list":
+            lengths = np.fromiter(map(len, records.values()), np.int64, len(records))
+            ids = np.repeat(np.fromiter(records.keys(), np.int64, len(records)), lengths)
+            visits = [visit for visits in records.values() for visit in visits]
+            times = np.fromiter((v[0] for v in visits), float, len(ids))
+            servers = np.fromiter((v[1] for v in visits), np.int16, len(ids))
+        elif mode == "server":
+            ids = np.fromiter(records.keys(), np.int64, len(records))
+            times = np.fromiter((v[0] for v in records.values()), float, len(ids))
+            servers = np.fromiter((v[1] for v in records.values()), np.int16, len(ids))
+        else:
+            ids = np.fromiter(records.keys(), np.int64, len(records))
+            times = np.fromiter(records.values(), float, len(ids))
+            servers = np.full(len(ids), -1, np.int16)
+        return {
+            "appliance_id": ids,
+            "stage": np.full(len(ids), stage, np.int8),
+            "kind": np.full(len(ids), kind, np.int8),
+            "time": times,
+            "server": servers,
+        }
+
+    def _rows(self, stage, kind):
+        """Appliance ids and times of the transitions of a stage and kind."""
+        key = ("rows", stage, kind)
+        if key not in self._cache:
+            table = self._table()
+            mask = table["code"] == stage * 4 + kind
+            self._cache[key] = table["appliance_id"][mask], table["time"][mask]
+        return self._cache[key]
+
+    def _column(self, stage, kind, last=False):
+        """
+        Time of the first (or last) transition of a stage and kind, indexed by
+        appliance id; NaN for appliances that never had it.
+        """
+        key = ("column", stage, kind, last)
+        if key in self._cache:
+            return self._cache[key]
+        ids, times = self._rows(stage, kind)
+        column = np.full(self._n_appliances(), np.nan)
+        if last:
+            ids, times = ids[::-1], times[::-1]
+        _, first = np.unique(ids, return_index=True)
+        column[ids[first]] = times[first]
+        self._cache[key] = column
+        return column
+
+    def _n_appliances(self):
+        ids = self._table()["appliance_id"]
+        return int(ids.max()) + 1 if len(ids) else 0
+
+    @staticmethod
+    def _mean(values):
+        values = values[~np.isnan(values)]
+        return float(values.mean()) if len(values) else 0
+
+    @staticmethod
+    def _visit_rank(ids):
+        # Position of every row inside its (sorted) group of appliance ids
+        if len(ids) == 0:
+            return ids
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        sizes = np.diff(np.r_[starts, len(ids)])
+        return np.arange(len(ids)) - np.repeat(starts, sizes)
+
+    def _visits(self):
+        """
+        Per-visit wait, service and sojourn times of every stage, paired from
+        consecutive transitions of the same appliance.
+        """
+        if "visits" in self._cache:
+            return self._cache["visits"]
+        table = self._table()
+        # A sentinel row at the end so that i + 1 and i + 2 are always valid
+        ids = np.r_[table["appliance_id"], -1]
+        code = np.r_[table["code"], -1]
+        time = np.r_[table["time"], np.nan]
+
+        # WAIT at i, BEGIN at i + 1 and the next transition (if any) at i + 2
+        i = np.flatnonzero(table["kind"] == WAIT)
+        served = (code[i + 1] == code[i] + (BEGIN - WAIT)) & (ids[i + 1] == ids[i])
+        i = i[served]
+        stage = table["stage"][i]
+        entered, begun, left = time[i], time[i + 1], time[i + 2]
+        left[ids[i + 2] != ids[i]] = np.nan
+
+        visits = {}
+        for code, name in self.stage_names.items():
+            at_stage = stage == code
+            begin, end = begun[at_stage], left[at_stage]
+            done = ~np.isnan(end)
+            visits[name] = {
+                "wait": begin - entered[at_stage],
+                "service": (end - begin)[done],
+                "sojourn": (end - entered[at_stage])[done],
+            }
+        self._cache["visits"] = visits
+        return visits
+
+    # |---------|
+    # | Metrics |
+    # |---------|
 
     def _simulation_duration(self):
-        arrivals = self.statistics["arrivals"]
-        departures = self.statistics["departure"]
-        return max(departures.values()) - min(arrivals.values())
+        if "duration" not in self._cache:
+            _, arrivals = self._rows(SYSTEM, ARRIVE)
+            _, departures = self._rows(SYSTEM, DEPART)
+            self._cache["duration"] = (
+                departures.max() - arrivals.min() if len(departures) else 0
+            )
+        return self._cache["duration"]
 
     def _arrival_rate(self):
-        arrivals = self.statistics["arrivals"]
-        T = self._simulation_duration()
-        return len(arrivals) / T if T > 0 else 0
+        if "arrival_rate" not in self._cache:
+            arrivals, _ = self._rows(SYSTEM, ARRIVE)
+            T = self._simulation_duration()
+            self._cache["arrival_rate"] = len(arrivals) / T if T > 0 else 0
+        return self._cache["arrival_rate"]
 
     def average_time_in_system(self):
-        total_time = 0
-        departures = self.statistics["departure"]
-        arrivals = self.statistics["arrivals"]
-        for a in departures:
-            total_time += departures[a] - arrivals[a]
-        return total_time / len(departures) if departures else 0
+        return self._mean(
+            self._column(SYSTEM, DEPART, last=True)
+            - self._column(SYSTEM, ARRIVE, last=True)
+        )
 
+    # Time from the arrival to the begin of the (first) classification
     def average_time_in_classification(self):
-        total_time = 0
-        classificated_at = self.statistics["classificated_at"]
-        arrivals = self.statistics["arrivals"]
-        for a in classificated_at:
-            total_time += classificated_at[a] - arrivals[a]
-        return total_time / len(classificated_at) if classificated_at else 0
+        return self._mean(
+            self._column(CLASSIFICATION, BEGIN) - self._column(SYSTEM, ARRIVE, last=True)
+        )
 
     def average_time_in_general_reparation(self):
-        total_time = 0
-        begin_general = self.statistics["begin_general_reparation"]
-        arrivals = self.statistics["arrivals"]
-        for a in begin_general:
-            total_time += begin_general[a][0] - arrivals[a]
-        return total_time / len(begin_general) if begin_general else 0
+        return self._mean(
+            self._column(GENERAL_REPARATION, BEGIN, last=True)
+            - self._column(SYSTEM, ARRIVE, last=True)
+        )
 
     def average_time_in_expert_reparation(self):
-        total_time = 0
-        begin_expert = self.statistics["begin_expert_reparation"]
-        arrivals = self.statistics["arrivals"]
-        for a in begin_expert:
-            total_time += begin_expert[a][0] - arrivals[a]
-        return total_time / len(begin_expert) if begin_expert else 0
+        return self._mean(
+            self._column(EXPERT_REPARATION, BEGIN, last=True)
+            - self._column(SYSTEM, ARRIVE, last=True)
+        )
 
     def average_time_in_shipping(self):
-        total_time = 0
-        begin_shipping = self.statistics["begin_shipping"]
-        arrivals = self.statistics["arrivals"]
-        for a in begin_shipping:
-            total_time += begin_shipping[a][0] - arrivals[a]
-        return total_time / len(begin_shipping) if begin_shipping else 0
+        return self._mean(
+            self._column(SHIPPING, BEGIN, last=True)
+            - self._column(SYSTEM, ARRIVE, last=True)
+        )
 
     # Using Little's Law: L = λ * W, where W is the average time in the node.
     def average_appliances_in_classification(self):
@@ -80,297 +268,425 @@ class Statistics:
     # Tiempo medio en la empresa desde que se clasifica hasta que se empaqueta.
     # Se calcula usando la diferencia entre el tiempo de salida (departure) y el momento en que termina la clasificación.
     def average_time_in_company(self):
-        total_time = 0
-        departures = self.statistics["departure"]
-        classificated_at = self.statistics["classificated_at"]
-        count = 0
-        for a in departures:
-            if a in classificated_at:
-                total_time += departures[a] - classificated_at[a]
-                count += 1
-        return total_time / count if count > 0 else 0
+        return self._mean(
+            self._column(SYSTEM, DEPART, last=True) - self._column(CLASSIFICATION, BEGIN)
+        )
 
     def average_time_in_node_classification(self):
-        total_waiting = 0
-        total_occurrences = 0
-
-        waiting_classification = self.statistics.get("waiting_classification", {})
-        # For exit times, merge waiting times from all next-node queues.
-        for appliance_id, entry_times in waiting_classification.items():
-            exit_times = []
-            # waiting_general_reparation might be a list for multiple occurrences
-            if appliance_id in self.statistics.get("waiting_general_reparation", {}):
-                val = self.statistics["waiting_general_reparation"][appliance_id]
-                if isinstance(val, list):
-                    exit_times.extend(val)
-                else:
-                    exit_times.append(val)
-            # waiting_expert_reparation is stored as a scalar or list
-            if appliance_id in self.statistics.get("waiting_expert_reparation", {}):
-                val = self.statistics["waiting_expert_reparation"][appliance_id]
-                if isinstance(val, list):
-                    exit_times.extend(val)
-                else:
-                    exit_times.append(val)
-            # waiting_shipping is stored as a scalar or list
-            if appliance_id in self.statistics.get("waiting_shipping", {}):
-                val = self.statistics["waiting_shipping"][appliance_id]
-                if isinstance(val, list):
-                    exit_times.extend(val)
-                else:
-                    exit_times.append(val)
-
-            # Sort entry and exit times to pair them in order.
-            entry_times_sorted = sorted(entry_times)
-            exit_times_sorted = sorted(exit_times)
-
-            # Pair occurrences in order (only as many pairs as the shortest list).
-            for entry, exit in zip(entry_times_sorted, exit_times_sorted):
-                if exit > entry:
-                    total_waiting += exit - entry
-                    total_occurrences += 1
-
-        return total_waiting / total_occurrences if total_occurrences > 0 else 0
+        # The k-th visit to classification ends when the appliance begins its
+        # k-th wait in any other stage
+        table = self._table()
+        is_wait = table["kind"] == WAIT
+        entering = is_wait & (table["stage"] == CLASSIFICATION)
+        leaving = is_wait & (table["stage"] != CLASSIFICATION)
+
+        def keyed(mask):
+            ids = table["appliance_id"][mask]
+            # Ranks stay far below 2**20 visits per appliance
+            return (ids << 20) + self._visit_rank(ids), table["time"][mask]
+
+        entry_keys, entry_times = keyed(entering)
+        exit_keys, exit_times = keyed(leaving)
+        _, a, b = np.intersect1d(
+            entry_keys, exit_keys, assume_unique=True, return_indices=True
+        )
+        waits = exit_times[b] - entry_times[a]
+        waits = waits[waits > 0]
+        return float(waits.mean()) if len(waits) else 0
 
     def average_wait_time_in_general_reparation(self):
-        total_wait = 0
-        total_occurrences = 0
-        waiting_general = self.statistics.get("waiting_general_reparation", {})
-        begin_general = self.statistics.get("begin_general_reparation", {})
-        for appliance_id, entry_times in waiting_general.items():
-            # Ensure entry_times is a list (for appliances with multiple entries)
-            if not isinstance(entry_times, list):
-                entry_times = [entry_times]
-            # Use the general reparation start time as exit time if available.
-            if appliance_id in begin_general:
-                begin_time = begin_general[appliance_id][0]
-                for entry in entry_times:
-                    if begin_time > entry:
-                        total_wait += begin_time - entry
-                        total_occurrences += 1
-        return total_wait / total_occurrences if total_occurrences > 0 else 0
+        # Every entry is compared against the recorded general reparation start
+        ids, entries = self._rows(GENERAL_REPARATION, WAIT)
+        waits = self._column(GENERAL_REPARATION, BEGIN, last=True)[ids] - entries
+        waits = waits[waits > 0]
+        return float(waits.mean()) if len(waits) else 0
+
+    def average_wait_time_in_expert_reparation(self):
+        return self._mean(
+            self._column(EXPERT_REPARATION, BEGIN, last=True)
+            - self._column(EXPERT_REPARATION, WAIT, last=True)
+        )
 
-    # ------------------------------------------------------------------------------
+    def average_wait_time_in_shipping(self):
+        return self._mean(
+            self._column(SHIPPING, BEGIN, last=True)
+            - self._column(SHIPPING, WAIT, last=True)
+        )
 
-    def plot_timeline(self):
-        import matplotlib.pyplot as plt
+    def report(self):
+        """
+        Returns every metric of the run in a single dict: the time in system,
+        the arrival rate and, for every stage, the mean wait, service and
+        sojourn time per visit plus the average number of appliances in it.
 
-        plt.figure(figsize=(12, 8))
+        Every visit is counted, including the appliances sent back from
+        general reparation to classification.
+        """
+        T = self._simulation_duration()
+        report = {
+            "n_arrivals": len(self._rows(SYSTEM, ARRIVE)[0]),
+            "n_departures": len(self._rows(SYSTEM, DEPART)[0]),
+            "arrival_rate": self._arrival_rate(),
+            "time_in_system": self.average_time_in_system(),
+        }
+        for name, visits in self._visits().items():
+            for metric, values in visits.items():
+                report[f"{metric}_{name}"] = (
+                    float(values.mean()) if len(values) else 0
+                )
+            # Little's law per stage: sum of sojourns over the observed span
+            report[f"appliances_in_{name}"] = (
+                float(visits["sojourn"].sum()) / T if T > 0 else 0
+            )
+        return report
 
-        # Get statistics dictionaries
-        arrivals = self.statistics.get("arrivals", {})
-        departures = self.statistics.get("departure", {})
-        classificated_at = self.statistics.get("classificated_at", {})
-        begin_general = self.statistics.get("begin_general_reparation", {})
-        begin_expert = self.statistics.get("begin_expert_reparation", {})
-        begin_shipping = self.statistics.get("begin_shipping", {})
+    # |--------------|
+    # | Steady state |
+    # |--------------|
 
-        # Set closing_time (if available in statistics, else use max departure)
-        closing_time = self.statistics.get(
-            "closing_time", max(departures.values()) if departures else 0
-        )
+    def steady_state_series(self):
+        """
+        Observations of the single long run in arrival order: the time in
+        system of every departed appliance and the waits of every stage.
+        """
+        arrivals = self._column(SYSTEM, ARRIVE, last=True)
+        time_in_system = self._column(SYSTEM, DEPART, last=True) - arrivals
+        series = {"time_in_system": time_in_system[~np.isnan(time_in_system)]}
+        for name, visits in self._visits().items():
+            series[f"wait_{name}"] = visits["wait"]
+        return series
+
+    def steady_state(self, n_batches=20, confidence=0.95):
+        """
+        Detects and discards the warm-up of every series with MSER-5 and
+        estimates its steady-state mean with a batch-means confidence
+        interval, all from this single run.
+        """
+        estimates = {}
+        for name, series in self.steady_state_series().items():
+            if len(series) < 2 * n_batches:
+                continue
+            estimates[name] = steady_state_estimate(series, n_batches, confidence)
+
+        # Simulated time at which the time in system reaches steady state
+        if "time_in_system" in estimates:
+            arrivals = self._column(SYSTEM, ARRIVE, last=True)
+            departed = ~np.isnan(self._column(SYSTEM, DEPART, last=True))
+            estimates["time_in_system"]["warmup_time"] = float(
+                arrivals[departed][estimates["time_in_system"]["warmup"]]
+            )
+        return estimates
 
-        # Iterate over each appliance in order (assuming keys are numeric IDs)
-        appliance_ids = sorted(arrivals.keys())
-        for appliance_id in appliance_ids:
-            a_time = arrivals[appliance_id]
-
-            # Extract classification time (take first occurrence if list)
-            c_time = classificated_at.get(appliance_id)
-            if isinstance(c_time, list):
-                c_time = c_time[0] if c_time else None
-
-            # Determine repair start: extract the time value from the tuple (time, server)
-            repair_time = None
-            if appliance_id in begin_general:
-                val = begin_general[appliance_id]
-                if isinstance(val, list):
-                    repair_time = val[0][0] if len(val) > 0 and val[0] else None
-                else:
-                    repair_time = val[0] if val else None
-                repair_label = "General Reparation Start"
-            elif appliance_id in begin_expert:
-                val = begin_expert[appliance_id]
-                if isinstance(val, list):
-                    repair_time = val[0][0] if len(val) > 0 and val[0] else None
-                else:
-                    repair_time = val[0] if val else None
-                repair_label = "Expert Reparation Start"
-            else:
-                repair_label = "Repair Start"
-
-            # Ensure shipping time is a scalar (extract time from tuple)
-            s_val = begin_shipping.get(appliance_id)
-            if isinstance(s_val, list):
-                s_time = s_val[0][0] if len(s_val) > 0 and s_val[0] else None
-            elif s_val is not None:
-                s_time = s_val[0]
-            else:
-                s_time = None
-
-            d_time = departures.get(appliance_id)
-
-            # Plot arrival to classification if classification time exists
-            if c_time is not None:
-                plt.plot(
-                    [a_time, c_time],
-                    [appliance_id, appliance_id],
-                    "b-",
-                    alpha=0.5,
-                    label=(
-                        "Arrival to Classification"
-                        if appliance_id == appliance_ids[0]
-                        else ""
-                    ),
-                )
-                plt.plot(
-                    a_time,
-                    appliance_id,
-                    "bo",
-                    label=("Arrival" if appliance_id == appliance_ids[0] else ""),
-                )
-                plt.plot(
-                    c_time,
-                    appliance_id,
-                    "g>",
-                    label=(
-                        "Classification" if appliance_id == appliance_ids[0] else ""
-                    ),
-                )
+    # |------------|
+    # | Comparison |
+    # |------------|
 
-            # Plot classification to repair start if repair_time exists
-            if (c_time is not None) and (repair_time is not None):
-                plt.plot(
-                    [c_time, repair_time],
-                    [appliance_id, appliance_id],
-                    "g-",
-                    linewidth=2,
-                    label=(repair_label if appliance_id == appliance_ids[0] else ""),
-                )
-                plt.plot(
-                    repair_time,
-                    appliance_id,
-                    "gv",
-                    label=(repair_label if appliance_id == appliance_ids[0] else ""),
-                )
+    @staticmethod
+    def paired_comparison(first, second, confidence=0.95):
+        """
+        Paired-t comparison of a metric measured on two configurations, one
+        value per replication, where replication i of both used the same seed
+        (common random numbers).
+
+        Returns the mean difference first - second with its confidence
+        interval, the correlation between the paired values and the variance
+        reduction: the variance of the difference had the runs been
+        independent over its actual variance, i.e. how many times fewer
+        replications the pairing needs for the same precision.
+        """
+        from scipy import stats
+
+        first = np.asarray(first, dtype=float)
+        second = np.asarray(second, dtype=float)
+        if len(first) != len(second):
+            raise ValueError("Both configurations need the same replications")
+        n = len(first)
+        if n < 2:
+            raise ValueError("Need at least 2 paired replications")
+        difference = first - second
+        variance = difference.var(ddof=1)
+        independent = first.var(ddof=1) + second.var(ddof=1)
+        mean = difference.mean()
+        half_width = stats.t.ppf((1 + confidence) / 2, n - 1) * np.sqrt(variance / n)
+        spread = first.std(ddof=1) * second.std(ddof=1)
+        return {
+            "mean_difference": float(mean),
+            "half_width": float(half_width),
+            "lower": float(mean - half_width),
+            "upper": float(mean + half_width),
+            "correlation": float(
+                np.cov(first, second)[0, 1] / spread if spread > 0 else 0.0
+            ),
+            "variance_reduction": float(
+                independent / variance if variance > 0 else np.inf
+            ),
+        }
 
-            # Plot repair to shipping start if both exist
-            if (repair_time is not None) and (s_time is not None):
-                plt.plot(
-                    [repair_time, s_time],
-                    [appliance_id, appliance_id],
-                    "m-",
-                    alpha=0.5,
-                    label=(
-                        "Repair to Shipping" if appliance_id == appliance_ids[0] else ""
-                    ),
-                )
-                plt.plot(
-                    s_time,
-                    appliance_id,
-                    "mo",
-                    label=(
-                        "Shipping Start" if appliance_id == appliance_ids[0] else ""
-                    ),
-                )
+    # ------------------------------------------------------------------------------
 
-            # Plot shipping to departure if both exist
-            if (s_time is not None) and (d_time is not None):
-                plt.plot(
-                    [s_time, d_time],
-                    [appliance_id, appliance_id],
-                    "r-",
-                    linewidth=2,
-                    label=(
-                        "Shipping to Departure"
-                        if appliance_id == appliance_ids[0]
-                        else ""
-                    ),
+    def plot_timeline(self, path=None, max_appliances=5000, time_bins=1000):
+        """
+        Plots the path of every appliance through the company: arrival,
+        classification, repair start, shipping start and departure.
+
+        Every segment type is drawn as a single LineCollection and every
+        marker type as a single line, so the cost grows with the number of
+        appliances only through numpy. Above max_appliances the individual
+        paths are unreadable anyway, and the figure becomes a Gantt heatmap
+        of the number of appliances in every phase over time.
+
+        With a path the figure is written there (PNG, SVG, ... after the
+        extension) without opening a window; otherwise it is shown.
+        Returns the figure.
+        """
+        from matplotlib.collections import LineCollection
+        from matplotlib.figure import Figure
+
+        if path is None:
+            import matplotlib.pyplot as plt
+
+            figure = plt.figure(figsize=(12, 8))
+        else:
+            figure = Figure(figsize=(12, 8))
+        axes = figure.subplots()
+
+        # Times of the first visit of every step, by appliance id
+        arrival = self._column(SYSTEM, ARRIVE)
+        classification = self._column(CLASSIFICATION, BEGIN)
+        repair = self._column(GENERAL_REPARATION, BEGIN)
+        repair = np.where(
+            np.isnan(repair), self._column(EXPERT_REPARATION, BEGIN), repair
+        )
+        shipping = self._column(SHIPPING, BEGIN)
+        departure = self._column(SYSTEM, DEPART)
+        ids = np.arange(len(arrival), dtype=float)
+        # Last recorded time, so partial runs (run(until=...), checkpoints,
+        # truncated traces) still cover every started phase
+        times = self._table()["time"]
+        closing_time = float(times.max()) if len(times) else 0.0
+
+        steps = [
+            (arrival, classification, "b", 1, 0.5, "Arrival to Classification"),
+            (classification, repair, "g", 2, 1.0, "Classification to Repair"),
+            (repair, shipping, "m", 1, 0.5, "Repair to Shipping"),
+            (shipping, departure, "r", 2, 1.0, "Shipping to Departure"),
+        ]
+        if len(ids) > max_appliances:
+            self._plot_phases(axes, figure, steps, closing_time, time_bins)
+        else:
+            for start, end, color, width, alpha, label in steps:
+                done = ~np.isnan(start) & ~np.isnan(end)
+                segments = np.stack(
+                    [
+                        np.column_stack([start[done], ids[done]]),
+                        np.column_stack([end[done], ids[done]]),
+                    ],
+                    axis=1,
                 )
-                plt.plot(
-                    d_time,
-                    appliance_id,
-                    "ro",
-                    label=("Departure" if appliance_id == appliance_ids[0] else ""),
+                axes.add_collection(
+                    LineCollection(
+                        segments,
+                        colors=color,
+                        linewidths=width,
+                        alpha=alpha,
+                        label=label,
+                    )
                 )
+            markers = [
+                (arrival, "bo", "Arrival"),
+                (classification, "g>", "Classification"),
+                (repair, "gv", "Repair Start"),
+                (shipping, "mo", "Shipping Start"),
+                (departure, "ro", "Departure"),
+            ]
+            for times, style, label in markers:
+                done = ~np.isnan(times)
+                axes.plot(times[done], ids[done], style, markersize=3, label=label)
+            axes.set_ylabel("Appliance ID")
+            axes.set_xlim(-5, closing_time + 5)
+            axes.set_ylim(-5, len(ids) + 5)
 
         # Add vertical line for closing time
-        plt.axvline(x=closing_time, color="k", linestyle="--", label="Closing Time")
+        axes.axvline(x=closing_time, color="k", linestyle="--", label="Closing Time")
 
         # Formatting
-        plt.title("Appliance Processing Timeline")
-        plt.xlabel("Time")
-        plt.ylabel("Appliance ID")
-        plt.xlim(-5, max(departures.values()) + 5)
-        plt.ylim(-5, max(appliance_ids) + 5)
-        plt.legend()
-        plt.grid(True, alpha=0.3)
-        plt.tight_layout()
-        plt.show()
-
-    # -----------------------------------------------------------------------------
-
-    def plot_histogram(self):
-        """
-        Plot the histogram of the statistics.
-        """
-        # Get the statistics
-        stats = self.best_stats()
-
-        # Plot each statistic
-        for key, values in stats.items():
-            plt.figure()
-            plt.hist(values, bins=30, density=True, alpha=0.6, color="g")
-            plt.title(f"Histogram of {key}")
-            plt.xlabel(key)
-            plt.ylabel("Density")
-            plt.grid(True)
+        axes.set_title("Appliance Processing Timeline")
+        axes.set_xlabel("Time")
+        axes.legend(loc="upper left")
+        axes.grid(True, alpha=0.3)
+        figure.tight_layout()
+        if path is None:
             plt.show()
-
-    def best_stats(self):
-        time_by_applience = []
-        for appliance_id in self.statistics["arrivals"]:
-            time_by_applience.append(
-                self.statistics["departure"][appliance_id]
-                - self.statistics["arrivals"][appliance_id]
+        else:
+            figure.savefig(path)
+        return figure
+
+    @staticmethod
+    def _plot_phases(axes, figure, steps, closing_time, time_bins):
+        # Gantt heatmap: appliances in every phase per time bin, from +1 in
+        # the bin where each phase starts and -1 where it ends, summed
+        width = closing_time / time_bins if closing_time > 0 else 1.0
+        density = np.zeros((len(steps), time_bins + 1))
+        for row, (start, end, *_) in enumerate(steps):
+            started = ~np.isnan(start)
+            end = np.where(np.isnan(end), closing_time, end)[started]
+            np.add.at(
+                density[row],
+                np.minimum(start[started] / width, time_bins).astype(np.int64),
+                1,
             )
-
-        classification_times = []
-        for appliance_id in self.statistics["classificated_at"]:
-            classification_times.append(
-                self.statistics["classificated_at"][appliance_id]
-                - self.statistics["arrivals"][appliance_id]
-            )
-
-        general_reparation_times = []
-        for appliance_id in self.statistics["begin_general_reparation"]:
-            general_reparation_times.append(
-                self.statistics["begin_general_reparation"][appliance_id][0]
-                - self.statistics["waiting_general_reparations"][appliance_id]
+            np.add.at(
+                density[row],
+                np.minimum(end / width, time_bins).astype(np.int64),
+                -1,
             )
+        image = axes.imshow(
+            np.cumsum(density, axis=1)[:, :time_bins],
+            aspect="auto",
+            origin="lower",
+            interpolation="nearest",
+            cmap="viridis",
+            extent=(0, width * time_bins, -0.5, len(steps) - 0.5),
+        )
+        figure.colorbar(image, ax=axes, label="Appliances")
+        axes.set_yticks(range(len(steps)), [step[-1] for step in steps])
 
-        expert_reparation_times = []
-        for appliance_id in self.statistics["begin_expert_reparation"]:
-            expert_reparation_times.append(
-                self.statistics["begin_expert_reparation"][appliance_id][0]
-                - self.statistics["waiting_expert_reparations"][appliance_id]
-            )
+    # |---------------|
+    # | Distributions |
+    # |---------------|
 
-        shipping_times = []
-        for appliance_id in self.statistics["begin_shipping"]:
-            shipping_times.append(
-                self.statistics["begin_shipping"][appliance_id][0]
-                - self.statistics["waiting_shippings"][appliance_id]
-            )
+    def distributions(self):
+        """
+        Per-observation arrays of the run: the time in system of every
+        departed appliance and, for every stage, the wait and sojourn of every
+        visit (appliances sent back to classification count once per visit).
+        """
+        arrivals = self._column(SYSTEM, ARRIVE, last=True)
+        time_in_system = self._column(SYSTEM, DEPART, last=True) - arrivals
+        distributions = {"time_in_system": time_in_system[~np.isnan(time_in_system)]}
+        for name, visits in self._visits().items():
+            distributions[f"wait_{name}"] = visits["wait"]
+            distributions[f"sojourn_{name}"] = visits["sojourn"]
+        return distributions
 
+    def best_stats(self):
+        """
+        The time by appliance and the wait of every visit to every stage of
+        the company, under their former names.
+        """
+        distributions = self.distributions()
+        names = {
+            "time_by_applience": "time_in_system",
+            "classification_times": "wait_classification",
+            "general_reparation_times": "wait_general_reparation",
+            "expert_reparation_times": "wait_expert_reparation",
+            "shipping_times": "wait_shipping",
+        }
         return {
-            "time_by_applience": time_by_applience,
-            "classification_times": classification_times,
-            "general_reparation_times": general_reparation_times,
-            "expert_reparation_times": expert_reparation_times,
-            "shipping_times": shipping_times,
+            key: distributions.get(name, np.empty(0)) for key, name in names.items()
         }
 
+    def fit_distributions(
+        self,
+        candidates=("expon", "gamma", "lognorm", "weibull_min"),
+        max_samples=20_000,
+        seed=0,
+    ):
+        """
+        Fits every candidate scipy.stats distribution (with location 0) to
+        the positive values of every array of distributions(), ranking them
+        by the Kolmogorov-Smirnov statistic. Waits are often exactly zero when
+        a server is idle, so that share is reported apart as p_zero. Arrays
+        longer than max_samples are fitted on a random subsample.
+
+        Returns {metric: {"n", "p_zero", "best", "fits": {name: {"params",
+        "ks", "aic"}}}}.
+        """
+        from scipy import stats
+
+        rng = np.random.default_rng(seed)
+        fitted = {}
+        for metric, values in self.distributions().items():
+            positive = values[values > 0]
+            entry = {
+                "n": len(values),
+                "p_zero": 1 - len(positive) / len(values) if len(values) else 0.0,
+                "best": None,
+                "fits": {},
+            }
+            fitted[metric] = entry
+            if len(positive) < 10:
+                continue
+            if len(positive) > max_samples:
+                positive = rng.choice(positive, max_samples, replace=False)
+            for name in candidates:
+                distribution = getattr(stats, name)
+                params = distribution.fit(positive, floc=0)
+                ks = stats.kstest(positive, name, args=params).statistic
+                free = len(params) - 1  # the location is fixed
+                log_likelihood = distribution.logpdf(positive, *params).sum()
+                entry["fits"][name] = {
+                    "params": tuple(float(p) for p in params),
+                    "ks": float(ks),
+                    "aic": float(2 * free - 2 * log_likelihood),
+                }
+            entry["best"] = min(entry["fits"], key=lambda n: entry["fits"][n]["ks"])
+        return fitted
+
+    def plot_histogram(self, path=None, bins=50, fit=True):
+        """
+        Plots the histogram of every array of distributions() in a single
+        figure with one panel per metric, binned with numpy so that long runs
+        cost no more than short ones, and with the best fitted distribution
+        of fit_distributions() on top.
+
+        With a path the figure is written there without opening a window;
+        otherwise it is shown. Returns the figure.
+        """
+        from matplotlib.figure import Figure
+
+        distributions = self.distributions()
+        fitted = self.fit_distributions() if fit else {}
+
+        columns = 3
+        rows = -(-len(distributions) // columns)
+        size = (5 * columns, 3.2 * rows)
+        if path is None:
+            import matplotlib.pyplot as plt
+
+            figure = plt.figure(figsize=size)
+        else:
+            figure = Figure(figsize=size)
+        panels = np.atleast_1d(figure.subplots(rows, columns, squeeze=False)).ravel()
+
+        for axes, (metric, values) in zip(panels, distributions.items()):
+            axes.set_title(f"{metric} (n={len(values)})")
+            axes.grid(True, alpha=0.3)
+            if not len(values):
+                continue
+            density, edges = np.histogram(values, bins=bins, density=True)
+            axes.stairs(density, edges, fill=True, alpha=0.6, color="g")
+            entry = fitted.get(metric)
+            if entry and entry["best"]:
+                from scipy import stats
+
+                best = entry["best"]
+                x = np.linspace(max(edges[0], 1e-9), edges[-1], 200)
+                # The fit only covers the positive part of the values
+                pdf = (1 - entry["p_zero"]) * getattr(stats, best).pdf(
+                    x, *entry["fits"][best]["params"]
+                )
+                axes.plot(x, pdf, "k-", linewidth=1, label=best)
+                axes.legend()
+        for axes in panels[len(distributions) :]:
+            axes.set_visible(False)
+
+        figure.tight_layout()
+        if path is None:
+            plt.show()
+        else:
+            figure.savefig(path)
+        return figure
 
 #
 
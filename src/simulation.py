@@ -1,360 +1,406 @@
-import heapq
-import numpy as np
-
-
-class ReparationCompanySimulation:
+from bisect import bisect_right
+from collections import deque
+import math
+import time
+
+from event_list import ARRIVAL, END_SERVICE, EVENT_NAMES, make_event_list
+from event_log import (
+    DictRecorder,
+    EventLog,
+    SYSTEM,
+    ARRIVE,
+    WAIT,
+    BEGIN,
+    DEPART,
+)
+from export import TraceWriter
+from network import company_network
+from online import OnlineRecorder
+from sampling import Sampler, make_sampler, substreams
+
+
+class NetworkSimulation:
     """
-    Simulates a reparation company with:
-
-    - 1 specialist in clasification
-    - 3 specialists in general reparations
-    - 4 expert specialists
-    - 2 shipping port
+    Simulates an open network of multi-server FIFO stages (see network.Network)
+    fed by Poisson arrivals.
+
+    Every stage is handled by the same dispatch and completion path, so the
+    stages, server counts, service distributions and routing all come from
+    the network. Service times are given either as distribution specs such as
+    ("exponential", 35), which are sampled in blocks from the simulation
+    generator, or as zero-argument functions called once per service.
+
+    variates="inverse" samples the specs by inversion of uniforms, and
+    variates="antithetic" from the complements of the same uniforms, which
+    pairs a run with its antithetic twin on the same seed (see
+    sampling.Sampler). event_list picks the future event list, "heap" or
+    "calendar" (see event_list).
     """
 
     def __init__(
         self,
+        network,
         arrival_rate,
-        classification_function,
-        general_reparation_function,
-        expert_reparation_function,
-        shipping_function,
         simulation_time=1000,
+        seed=None,
+        recorder="dict",
+        block_size=1024,
+        variates="native",
+        event_list="heap",
     ):
 
         # |------------|
         # | Parameters |
         # |------------|
 
+        # seed may be an int, a SeedSequence or an existing Generator. Every
+        # purpose draws from its own substream: the arrivals, the services of
+        # every stage and the routing out of every stage, so that runs of
+        # other configurations on the same seed reuse the same numbers
+        n_stages = len(network.stages)
+        self.streams = substreams(seed, 1 + 2 * n_stages)
+        self.rng = self.streams[0]
+        self.variates = variates
+
+        self.network = network
         self.arrival_rate = arrival_rate  # lambda parameter for Poisson
-        self.classification_function = (
-            classification_function  # function to generate classification service time
-        )
-        self.general_reparation_function = general_reparation_function  # function to generate general reparation service time
-        self.expert_reparation_function = expert_reparation_function  # function to generate expert reparation service time
-        self.shipping_function = (
-            shipping_function  # function to generate shipping service time
-        )
         self.simulation_time = simulation_time
-
-        self.rng = np.random.default_rng()
+        self.entry = network.index[network.entry]
+
+        # functions to generate the service time of every stage
+        self.services = [
+            make_sampler(stage.service, self.streams[1 + k], block_size, variates)
+            for k, stage in enumerate(network.stages)
+        ]
+        # (targets, cumulative probabilities) of every stage, -1 means leaving
+        self.routes = [network.routing_table(name) for name in network.names]
+
+        # Interarrival times and the uniforms used to route appliances
+        self.interarrival = Sampler(
+            ("exponential", 1 / arrival_rate), self.rng, block_size, variates
+        )
+        self.uniforms = [
+            Sampler(("random",), self.streams[1 + n_stages + k], block_size, variates)
+            for k in range(n_stages)
+        ]
 
         # |------------------|
         # | Simulation state |
         # |------------------|
 
         self.time = 0
+        self.started = False  # whether the first arrival was scheduled
         self.n_appliances = 0  # counter to give ids to appliences
-        self.events_queue = (
-            []
-        )  # heap queue containing tuples (t, event) or (t, event, index)
-        self.events = {
-            "arrival": self.new_arrival,
-            "end_classification": self.classification_ended,
-            "end_general_reparation": self.general_reparation_ended,
-            "end_expert_reparation": self.expert_reparation_ended,
-            "end_shipping": self.shipping_ended,
-        }
-
-        self.q_classification = []  # Queue for classification
-        self.q_general_reparation = []  # Queue for general reparation
-        self.q_expert_reparation = []  # Queue for expert reparation
-        self.q_shipping = []  # Queue for shipping
-
-        # stores the id of the appliences using the respective servers; if none then -1
-        self.classification_status = -1
-        self.general_reparation_status = [-1, -1, -1]
-        self.expert_reparation_status = [-1, -1, -1, -1]
-        self.shipping_status = [-1, -1]
+        # future event list of (t, sequence, code, stage, server) entries,
+        # see event_list; the sequence breaks ties in scheduling order
+        self.events_queue = make_event_list(event_list)
+        self.n_scheduled = 0
+        # handler of every event code, called with (stage, server)
+        self.events = [self.new_arrival, self.service_ended]
+
+        # callables notified of every dispatched event, see instrumentation
+        self.observers = []
+
+        # FIFO queue of every stage
+        self.queues = [deque() for _ in network.stages]
+
+        # stores the id of the appliences using the servers of every stage; if none then -1
+        self.status = [[-1] * stage.servers for stage in network.stages]
+
+        # stacks with the indexes of the idle servers of every stage (lowest on top)
+        self.idle = [list(range(stage.servers - 1, -1, -1)) for stage in network.stages]
+
+        # |------------------------|
+        # | Time-weighted tracking |
+        # |------------------------|
+
+        # Sums of the times appliances joined and left the queue of every
+        # stage: the integral of the queue length up to T is
+        # queue_left - queue_entered + len(queue) * T, so the event loop only
+        # pays one addition when a queue changes
+        self.queue_entered = [0.0] * len(network.stages)
+        self.queue_left = [0.0] * len(network.stages)
+        self.max_queue = [0] * len(network.stages)
+        # busy time of every server and the begin of its current busy period
+        self.busy_time = [[0.0] * stage.servers for stage in network.stages]
+        self.busy_since = [[0.0] * stage.servers for stage in network.stages]
 
         # |---------------------|
         # | Statistics tracking |
         # |---------------------|
 
-        self.arrivals = {}  # arrivals[i] = time of arrival of applience i
-        self.waiting_classification = (
-            {}
-        )  # waiting_classification[i][j] time of begin waiting for classificacion of appliance i for the j-th time
-        self.classificated_at = (
-            {}
-        )  # classificated_at[i][j] = time of arrival of appliance i to classification the j-th time
-        self.waiting_general_reparation = (
-            {}
-        )  # waiting_general_reparation[i][j] = time of begin waiting for general reparation of appliance i for the j-th time
-        self.begin_general_reparation = (
-            {}
-        )  # begin_general_reparation[i][j] = tuple(time,server) of begin of general reparation of appliance i for the j-th time
-        self.waiting_expert_reparation = (
-            {}
-        )  # waiting_expert_reparation[i] = time of begin waiting for expert reparation of appliance i
-        self.begin_expert_reparation = (
-            {}
-        )  # begin_expert_reparation[i] = tuple(time,server) of begin of expert reparation of appliance i
-        self.waiting_shipping = (
-            {}
-        )  # waiting_shipping[i] = time of begin waiting for shipping of appliance i
-        self.begin_shipping = (
-            {}
-        )  # begin_shipping[i] = tuple(time,server) of arrive to shipping server of appliance i
-        self.departure = {}  # departure[i] = time of departure of applience i
+        # "dict" keeps one dict per statistic (see network.Network.dict_layout),
+        # "array" keeps a compact EventLog with one row per stage transition,
+        # "online" only keeps running summaries in constant memory.
+        # Stage codes in the records are the stage index plus one (0 is SYSTEM).
+        if recorder == "dict":
+            self.recorder = DictRecorder(network.dict_layout())
+        elif recorder == "array":
+            self.recorder = EventLog()
+        elif recorder == "online":
+            self.recorder = OnlineRecorder(
+                {network.stage_code(name): name for name in network.names}
+            )
+        elif isinstance(recorder, str):
+            raise ValueError(f"Unknown recorder {recorder!r}")
+        else:
+            self.recorder = recorder
 
         # |--------|
         # | Events |
         # |--------|
 
-    def new_arrival(self):  # event
+    def new_arrival(self, stage=-1, server=-1):  # event, arguments unused
         appliance_id = self.n_appliances
         self.n_appliances += 1
-        self.arrivals[appliance_id] = self.time
-        self.waiting_classification[appliance_id] = [self.time]
-
-        # case 1: Classification Specialist is idle
-        if self.classification_status < 0:
-            # Process the applience inmediately
-            self.process_classification(appliance_id)
-
-        # case 2: Classification Specialist is busy
-        else:
-            # Add the appliance to classification queue
-            self.q_classification.append(appliance_id)
+        self.recorder.record(appliance_id, SYSTEM, ARRIVE, self.time)
+        self.recorder.record(appliance_id, self.entry + 1, WAIT, self.time)
+        self.dispatch(self.entry, appliance_id)
 
         # generate the next arrival
         self.next_arrival()
 
-    def process_classification(self, appliance_id):
-        self.classification_status = appliance_id
-        if appliance_id in self.classificated_at:
-            self.classificated_at[appliance_id].append(self.time)
-        else:
-            self.classificated_at[appliance_id] = [self.time]
-        duration = self.classification_function()
-        maint_time_end = self.time + duration
-        heapq.heappush(self.events_queue, (maint_time_end, "end_classification"))
-
     def next_arrival(self):
         if self.time >= self.simulation_time:
             return
-        time_arrival = self.rng.exponential(1 / self.arrival_rate)
+        time_arrival = self.interarrival()
         next_time_arrival = self.time + time_arrival
         if next_time_arrival < self.simulation_time:
-            heapq.heappush(self.events_queue, (next_time_arrival, "arrival"))
-
-    def classification_ended(self):  # event
-        assert self.classification_status >= 0
-        appliance_id = self.classification_status
-
-        def send_2_next_stage():
-            # Generate a random number between 0 and 1
-            rand = self.rng.random()
-
-            # It must decide next stage with:
-
-            # 17% go to shipping
-            if rand < 0.17:
-                return 0
-            # 47,31% go to general reparations
-            elif rand < 0.17 + 0.4731:
-                return 1
-            # 35,69% go to expert reparations
-            else:
-                return 2
-
-        next_stage = send_2_next_stage()
-
-        if next_stage == 0:
-            self.waiting_shipping[appliance_id] = self.time
-        elif next_stage == 1:
-            # An applience can pass for this stage more than one
-            if appliance_id in self.waiting_general_reparation:
-                self.waiting_general_reparation[appliance_id].append(self.time)
-            else:
-                self.waiting_general_reparation[appliance_id] = [self.time]
-        else:
-            self.waiting_expert_reparation[appliance_id] = self.time
-
-        # Process next applience in classification queue
-        if self.q_classification:
-            next_applience_id = self.q_classification.pop(0)
-            self.process_classification(next_applience_id)
-        else:
-            self.classification_status = -1
+            self.n_scheduled += 1
+            self.events_queue.push(
+                (next_time_arrival, self.n_scheduled, ARRIVAL, -1, -1)
+            )
 
-        # Send to next stage
-        if next_stage == 0:
-            # Send to shipping
-            self.send2shipping(appliance_id)
-        elif next_stage == 1:
-            self.send2general(appliance_id)
-        else:
-            self.send2expert(appliance_id)
-
-    def send2general(self, applience_id):
-        if self.q_general_reparation:
-            self.q_general_reparation.append(applience_id)
-        else:
-            if not (-1 in self.general_reparation_status):
-                self.q_general_reparation.append(applience_id)
-            else:
-                index = self.general_reparation_status.index(-1)
-                self.process_general_reparation(index, applience_id)
-
-    def send2expert(self, applience_id):
-        if self.q_expert_reparation:
-            self.q_expert_reparation.append(applience_id)
+    def route(self, stage, appliance_id=-1):
+        """
+        Draws the stage an appliance goes to after stage; -1 means leaving.
+        The appliance is only used by subclasses such as replay.ReplaySimulation.
+        """
+        targets, cumulative = self.routes[stage]
+        if len(targets) == 1:
+            return targets[0]
+        return targets[bisect_right(cumulative, self.uniforms[stage]())]
+
+    def dispatch(self, stage, appliance_id):
+        """Sends the appliance to an idle server of stage, or to its queue."""
+        idle = self.idle[stage]
+        queue = self.queues[stage]
+        if queue or not idle:
+            queue.append(appliance_id)
+            self.queue_entered[stage] += self.time
+            if len(queue) > self.max_queue[stage]:
+                self.max_queue[stage] = len(queue)
         else:
-            if not (-1 in self.expert_reparation_status):
-                self.q_expert_reparation.append(applience_id)
-            else:
-                index = self.expert_reparation_status.index(-1)
-                self.process_expert_reparation(index, applience_id)
-
-    def process_shipping(self, index, applience_id):
-        self.shipping_status[index] = applience_id
-        self.begin_shipping[applience_id] = (self.time, index)
-        duration = self.shipping_function()
-        shipping_time_end = self.time + duration
-        heapq.heappush(self.events_queue, (shipping_time_end, "end_shipping", index))
-
-    def process_general_reparation(self, index, applience_id):
-        self.general_reparation_status[index] = applience_id
-        self.begin_general_reparation[applience_id] = (self.time, index)
-        duration = self.general_reparation_function()
-        general_time_end = self.time + duration
-        heapq.heappush(
-            self.events_queue, (general_time_end, "end_general_reparation", index)
+            server = idle.pop()
+            self.busy_since[stage][server] = self.time
+            self.process(stage, server, appliance_id)
+
+    def process(self, stage, server, appliance_id):
+        self.status[stage][server] = appliance_id
+        self.recorder.record(appliance_id, stage + 1, BEGIN, self.time, server)
+        duration = self.services[stage]()
+        self.n_scheduled += 1
+        self.events_queue.push(
+            (self.time + duration, self.n_scheduled, END_SERVICE, stage, server)
         )
 
-    def process_expert_reparation(self, index, applience_id):
-        self.expert_reparation_status[index] = applience_id
-        self.begin_expert_reparation[applience_id] = (self.time, index)
-        duration = self.expert_reparation_function()
-        expert_time_end = self.time + duration
-        heapq.heappush(
-            self.events_queue, (expert_time_end, "end_expert_reparation", index)
-        )
+    def service_ended(self, stage, server):  # event
+        assert self.status[stage][server] >= 0
+        appliance_id = self.status[stage][server]
 
-    def general_reparation_ended(self, index):  # event
-        assert self.general_reparation_status[index] >= 0
-        applience_id = self.general_reparation_status[index]
-
-        def classificacion_or_shipping():
-            # Generate a random number between 0 and 1
-            rand = self.rng.random()
-
-            # 5% go back to classification
-            if rand < 0.05:
-                return 0
-            # 95% go to shipping
-            else:
-                return 1
-
-        next_stage = classificacion_or_shipping()
-
-        if next_stage == 0:
-            # An applience can pass for this stage more than one
-            if applience_id in self.waiting_general_reparation:
-                self.waiting_classification[applience_id].append(self.time)
-            else:
-                print("No deberia entrar aqui")
-                self.waiting_classification[applience_id] = [self.time]
+        next_stage = self.route(stage, appliance_id)
+        if next_stage < 0:
+            self.recorder.record(appliance_id, SYSTEM, DEPART, self.time)
         else:
-            self.waiting_shipping[applience_id] = self.time
-
-        # Process next applience in general reparations queue
-        if self.q_general_reparation:
-            next_applience_id = self.q_general_reparation.pop(0)
-            self.process_general_reparation(index, next_applience_id)
+            # An applience can pass for a stage more than once
+            self.recorder.record(appliance_id, next_stage + 1, WAIT, self.time)
+
+        # Process next applience in the queue of the stage
+        queue = self.queues[stage]
+        if queue:
+            self.queue_left[stage] += self.time
+            self.process(stage, server, queue.popleft())
         else:
-            self.general_reparation_status[index] = -1
+            self.status[stage][server] = -1
+            self.idle[stage].append(server)
+            self.busy_time[stage][server] += self.time - self.busy_since[stage][server]
 
         # Send to next stage
-        if next_stage == 0:
-            self.send2classification(applience_id)
-        else:
-            self.send2shipping(applience_id)
-
-    def expert_reparation_ended(self, index):  # event
-        assert self.expert_reparation_status[index] >= 0
-        applience_id = self.expert_reparation_status[index]
-        self.waiting_shipping[applience_id] = self.time
-
-        # Process next applience in the expert reparation queue
-        if self.q_expert_reparation:
-            next_applience_id = self.q_expert_reparation.pop(0)
-            self.process_expert_reparation(index, next_applience_id)
-        else:
-            self.expert_reparation_status[index] = -1
-
-        # Send to shipping
-        self.send2shipping(applience_id)
-
-    def send2classification(self, applience_id):
-        if self.q_classification:
-            self.q_classification.append(applience_id)
-        else:
-            if self.classification_status == -1:  # there is no applience been processed
-                self.process_classification(applience_id)
-            else:
-                self.q_classification.append(applience_id)
-
-    def send2shipping(self, applience_id):
-        if self.q_shipping:
-            self.q_shipping.append(applience_id)
-        else:
-            if not (-1 in self.shipping_status):
-                self.q_shipping.append(applience_id)
-            else:
-                index = 0 if self.shipping_status[0] == -1 else 1
-                self.process_shipping(index, applience_id)
-
-    def shipping_ended(self, index):  # event
-        assert self.shipping_status[index] >= 0
-        appliance_id = self.shipping_status[index]
-        self.departure[appliance_id] = self.time
-
-        # Process next applience in the shipping queue
-        if self.q_shipping:
-            next_applience_id = self.q_shipping.pop(0)
-            self.process_shipping(index, next_applience_id)
-        else:
-            self.shipping_status[index] = -1
+        if next_stage >= 0:
+            self.dispatch(next_stage, appliance_id)
 
     ## |-----------------|
     ## | Simulation loop |
     ## |-----------------|
 
-    def run(self):
-        """Run the simulation until all events are processed."""
-        self.next_arrival()
-        while self.events_queue:
-            # Get the next event
-            self.time, event, *args = heapq.heappop(self.events_queue)
-
-            # Call the event function
+    def run(self, until=None):
+        """
+        Run the simulation until all events are processed, or only the events
+        up to the simulated time until. A later call continues where the
+        previous one stopped.
+        """
+        if not self.started:
+            self.started = True
+            self.next_arrival()
+        if until is None and not self.observers:
+            queue = self.events_queue
+            pop = queue.pop
+            events = self.events
+            while queue:
+                # Get the next event
+                self.time, _, event, stage, server = pop()
+
+                # Call the event function
+                events[event](stage, server)
+        else:
+            self._run_until(math.inf if until is None else until)
+
+    def _run_until(self, until):
+        # Same loop, stopping at until and notifying the observers if any
+        perf_counter = time.perf_counter
+        observers = self.observers
+        queue = self.events_queue
+        while queue and queue.peek_time() <= until:
+            self.time, _, event, *args = queue.pop()
+            if not observers:
+                self.events[event](*args)
+                continue
+            start = perf_counter()
             self.events[event](*args)
+            elapsed = perf_counter() - start
+            for observer in observers:
+                observer(self, event, args, start, elapsed)
 
-            # Schedule the next arrival
-            # self.next_arrival()
-
-        # return self.departure
+    def add_observer(self, observer):
+        """
+        Attaches a callable observer(simulation, event, args, start, elapsed)
+        called after every dispatched event (see instrumentation.Profiler and
+        instrumentation.ChromeTrace).
+        """
+        self.observers.append(observer)
+        return observer
+
+    def __getstate__(self):
+        # The handlers are bound methods and the observers belong to the
+        # process, so neither is part of a checkpoint (see checkpoint.py)
+        state = self.__dict__.copy()
+        del state["events"]
+        state["observers"] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.events = [self.new_arrival, self.service_ended]
+
+    def event_label(self, event, args):
+        """Readable name of an event code: "arrival" or "end_<stage>"."""
+        if event == END_SERVICE:
+            return f"end_{self.network.names[args[0]]}"
+        return EVENT_NAMES[event]
 
     def get_statistics(self):
         """
         Returns the statistics of the simulation.
+
+        The dicts are built from the event log on demand when the simulation
+        records with recorder="array", and read back from the file when it
+        records to an export.TraceWriter, which is closed first. With
+        recorder="online" only the summary of OnlineRecorder.to_statistics()
+        is available.
+        """
+        if isinstance(self.recorder, (EventLog, TraceWriter)):
+            return self.recorder.to_statistics(self.network.dict_layout())
+        return self.recorder.to_statistics()
+
+    def get_utilization(self):
+        """
+        Returns, for every stage, the utilization of its servers, the mean
+        number of busy servers, the mean and max queue length and the busy
+        fraction of every server, all time-averaged over [0, time].
         """
-        # Return the statistics
-
-        statistics = {
-            "arrivals": self.arrivals,
-            "waiting_classification": self.waiting_classification,
-            "classificated_at": self.classificated_at,
-            "waiting_general_reparation": self.waiting_general_reparation,
-            "begin_general_reparation": self.begin_general_reparation,
-            "waiting_expert_reparation": self.waiting_expert_reparation,
-            "begin_expert_reparation": self.begin_expert_reparation,
-            "waiting_shipping": self.waiting_shipping,
-            "begin_shipping": self.begin_shipping,
-            "departure": self.departure,
-        }
-
-        return statistics
+        T = self.time
+        utilization = {}
+        for stage, name in enumerate(self.network.names):
+            servers = len(self.status[stage])
+            queue_area = (
+                self.queue_left[stage]
+                - self.queue_entered[stage]
+                + len(self.queues[stage]) * T
+            )
+            busy_time = [
+                self.busy_time[stage][k]
+                + (T - self.busy_since[stage][k] if self.status[stage][k] >= 0 else 0)
+                for k in range(servers)
+            ]
+            busy_area = sum(busy_time)
+            utilization[name] = {
+                "utilization": busy_area / (servers * T) if T > 0 else 0.0,
+                "mean_busy_servers": busy_area / T if T > 0 else 0.0,
+                "mean_queue_length": queue_area / T if T > 0 else 0.0,
+                "max_queue_length": self.max_queue[stage],
+                "server_busy_fraction": [b / T if T > 0 else 0.0 for b in busy_time],
+            }
+        return utilization
+
+    @property
+    def event_log(self):
+        """The EventLog of the run, or None when recording into dicts."""
+        return self.recorder if isinstance(self.recorder, EventLog) else None
+
+
+class ReparationCompanySimulation(NetworkSimulation):
+    """
+    Simulates a reparation company with:
+
+    - 1 specialist in clasification
+    - 3 specialists in general reparations
+    - 4 expert specialists
+    - 2 shipping port
+
+    servers may override some of those counts, e.g. {"general_reparation": 4}.
+    """
+
+    def __init__(
+        self,
+        arrival_rate,
+        classification_function,
+        general_reparation_function,
+        expert_reparation_function,
+        shipping_function,
+        simulation_time=1000,
+        seed=None,
+        recorder="dict",
+        block_size=1024,
+        servers=None,
+        variates="native",
+        event_list="heap",
+    ):
+        network = company_network(
+            classification_function,
+            general_reparation_function,
+            expert_reparation_function,
+            shipping_function,
+            servers,
+        )
+        super().__init__(
+            network,
+            arrival_rate,
+            simulation_time,
+            seed,
+            recorder,
+            block_size,
+            variates,
+            event_list,
+        )
+
+    # Queues and servers of every stage under their former names
+
+    q_classification = property(lambda self: self.queues[0])
+    q_general_reparation = property(lambda self: self.queues[1])
+    q_expert_reparation = property(lambda self: self.queues[2])
+    q_shipping = property(lambda self: self.queues[3])
+
+    classification_status = property(lambda self: self.status[0][0])
+    general_reparation_status = property(lambda self: self.status[1])
+    expert_reparation_status = property(lambda self: self.status[2])
+    shipping_status = property(lambda self: self.status[3])
@@ -0,0 +1,89 @@
+import numpy as np
+
+
+def mser(series, batch_size=5):
+    """
+    Detects the end of the transient of a series with MSER-m (MSER-5 by
+    default): the series is averaged in batches of batch_size and truncated
+    at the batch d <= n / 2 minimizing the marginal standard error
+
+        MSER(d) = sum_{i > d} (Y_i - mean_{i > d} Y)^2 / (n - d)^2
+
+    Returns the number of original observations to discard.
+    """
+    series = np.asarray(series, dtype=float)
+    n = len(series) // batch_size
+    if n < 2:
+        return 0
+    batches = series[: n * batch_size].reshape(n, batch_size).mean(axis=1)
+
+    # Suffix sums give the error of every truncation point at once
+    s1 = np.cumsum(batches[::-1])[::-1]
+    s2 = np.cumsum((batches**2)[::-1])[::-1]
+    remaining = n - np.arange(n)
+    sse = s2 - s1**2 / remaining
+    candidates = n // 2 + 1
+    d = int(np.argmin(sse[:candidates] / remaining[:candidates] ** 2))
+    return d * batch_size
+
+
+def welch_average(replications, window):
+    """
+    Welch's procedure: averages the series of several replications point by
+    point and smooths the result with a centered moving average of
+    2 * window + 1 points (shorter at the start). The warm-up ends where the
+    returned curve flattens.
+    """
+    curve = np.atleast_2d(np.asarray(replications, dtype=float)).mean(axis=0)
+    cumulative = np.r_[0, np.cumsum(curve)]
+    i = np.arange(max(len(curve) - window, 0))
+    half = np.minimum(i, window)
+    return (cumulative[i + half + 1] - cumulative[i - half]) / (2 * half + 1)
+
+
+def batch_means(series, n_batches=20, confidence=0.95):
+    """
+    Confidence interval of the steady-state mean of a (truncated) series
+    with the method of non-overlapping batch means.
+
+    Returns a dict with the mean, the half width and bounds of the interval,
+    the batch size and the lag-1 autocorrelation of the batch means, which
+    should be close to zero for the interval to be trusted.
+    """
+    from scipy import stats
+
+    series = np.asarray(series, dtype=float)
+    batch_size = len(series) // n_batches
+    if batch_size < 1 or n_batches < 2:
+        raise ValueError(
+            f"Need at least {max(n_batches, 2)} observations for batch means"
+        )
+    means = series[: n_batches * batch_size].reshape(n_batches, batch_size).mean(axis=1)
+    mean = means.mean()
+    half_width = stats.t.ppf((1 + confidence) / 2, n_batches - 1) * means.std(
+        ddof=1
+    ) / np.sqrt(n_batches)
+    centered = means - mean
+    denominator = (centered**2).sum()
+    autocorrelation = (
+        (centered[1:] * centered[:-1]).sum() / denominator if denominator > 0 else 0.0
+    )
+    return {
+        "mean": float(mean),
+        "half_width": float(half_width),
+        "lower": float(mean - half_width),
+        "upper": float(mean + half_width),
+        "batch_size": batch_size,
+        "lag1_autocorrelation": float(autocorrelation),
+    }
+
+
+def steady_state_estimate(series, n_batches=20, confidence=0.95, batch_size=5):
+    """
+    Discards the warm-up found by MSER and applies batch means to the rest.
+    """
+    warmup = mser(series, batch_size)
+    estimate = batch_means(series[warmup:], n_batches, confidence)
+    estimate["warmup"] = warmup
+    estimate["observations"] = len(series) - warmup
+    return estimate
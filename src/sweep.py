@@ -0,0 +1,188 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+from replication import (
+    DEFAULT_PARAMETERS,
+    SUMMARY_FIELDS,
+    _run_chunk,
+    replication_seeds,
+)
+
+
+# Bump when the model or the summary changes, so that old results are ignored
+CACHE_VERSION = 4
+
+
+def parameter_grid(grid):
+    """
+    Expands {name: [values]} into the list of parameter dicts of every
+    combination, e.g. {"arrival_rate": [5 / 60, 10 / 60],
+    "general_reparation_servers": [3, 4]} gives four cells. Names are those
+    of replication.DEFAULT_PARAMETERS.
+    """
+    unknown = set(grid) - set(DEFAULT_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown parameters {sorted(unknown)}")
+    names = sorted(grid)
+    return [
+        dict(zip(names, values))
+        for values in itertools.product(*(grid[name] for name in names))
+    ]
+
+
+def normalize_parameters(parameters):
+    """
+    Complete parameters (defaults included) with server counts as ints and
+    the other numbers as floats, so that e.g. 35 and 35.0 are the same cell.
+    """
+    normalized = dict(DEFAULT_PARAMETERS, **parameters)
+    for name, value in normalized.items():
+        if name.endswith("_servers"):
+            normalized[name] = int(value)
+        elif not isinstance(value, str):
+            normalized[name] = float(value)
+    return normalized
+
+
+def cell_key(parameters, seed):
+    """
+    Hash identifying the result of one replication: the complete normalized
+    parameters (defaults included, so changing a default invalidates the
+    cell) and the SeedSequence of the replication.
+    """
+    config = {
+        "version": CACHE_VERSION,
+        "parameters": normalize_parameters(parameters),
+        "entropy": str(seed.entropy),
+        "spawn_key": list(seed.spawn_key),
+    }
+    encoded = json.dumps(config, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class ResultCache:
+    """
+    SQLite table of replication summaries keyed by cell_key. Only the parent
+    process writes to it, one committed row per finished replication, so an
+    interrupted sweep keeps everything it computed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, parameters TEXT, summary TEXT)"
+        )
+        self.connection.commit()
+
+    def get(self, key):
+        row = self.connection.execute(
+            "SELECT summary FROM results WHERE key = ?", (key,)
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, key, parameters, summary):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+            (key, json.dumps(parameters, sort_keys=True), json.dumps(summary)),
+        )
+        self.connection.commit()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+def run_sweep(
+    grid,
+    replications=1,
+    master_seed=0,
+    cache="sweep.sqlite",
+    max_workers=None,
+):
+    """
+    Runs `replications` replications of every cell of parameter_grid(grid)
+    over a process pool, skipping the ones already in the cache.
+
+    Replication i of every cell uses the i-th child of master_seed, so cells
+    share their random numbers and rerunning a sweep where only some values
+    changed only computes the new cells. cache is a path or a ResultCache.
+
+    Returns the rows {**parameters, "replication": i, **summary} in grid
+    order, and the number of replications actually run.
+    """
+    cells = parameter_grid(grid)
+    seeds = replication_seeds(master_seed, 0, replications)
+    store = cache if isinstance(cache, ResultCache) else ResultCache(cache)
+
+    results, missing = {}, []
+    for c, parameters in enumerate(cells):
+        for i, seed in enumerate(seeds):
+            key = cell_key(parameters, seed)
+            summary = store.get(key)
+            if summary is None:
+                missing.append((c, i, key, seed))
+            else:
+                results[c, i] = summary
+
+    def store_result(c, i, key, row):
+        summary = dict(zip(SUMMARY_FIELDS, row.tolist()))
+        store.put(key, cells[c], summary)
+        results[c, i] = summary
+
+    try:
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        if max_workers == 1:
+            for c, i, key, seed in missing:
+                store_result(c, i, key, _run_chunk([seed], cells[c])[0])
+        elif missing:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    executor.submit(_run_chunk, [seed], cells[c]): (c, i, key)
+                    for c, i, key, seed in missing
+                }
+                for future in as_completed(futures):
+                    store_result(*futures[future], future.result()[0])
+    finally:
+        if store is not cache:
+            store.close()
+
+    rows = [
+        {**parameters, "replication": i, **results[c, i]}
+        for c, parameters in enumerate(cells)
+        for i in range(replications)
+    ]
+    return rows, len(missing)
+
+
+def sweep_table(rows, metric):
+    """
+    Averages metric over the replications of every cell. Returns a list of
+    (parameters, mean, standard deviation) in grid order.
+    """
+    cells = {}
+    for row in rows:
+        parameters = tuple(
+            (name, value)
+            for name, value in row.items()
+            if name in DEFAULT_PARAMETERS
+        )
+        cells.setdefault(parameters, []).append(row[metric])
+    return [
+        (
+            dict(parameters),
+            float(np.mean(values)),
+            float(np.std(values, ddof=1)) if len(values) > 1 else 0.0,
+        )
+        for parameters, values in cells.items()
+    ]